@@ -0,0 +1,401 @@
+from odoo import models, fields, api
+from odoo.tools import SQL
+from odoo.tools.sql import create_index, index_exists
+from collections import defaultdict
+from datetime import timedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# field timesheet yang mempengaruhi nilai turunan task (actual mandays, tanggal aktual, count);
+# dilengkapi depends compute task lewat project.task._portal_dirty_fields
+TASK_DIRTY_FIELDS = {
+    'task_id', 'unit_amount', 'date', 'employee_id', 'z_state',
+    'z_timesheet_start_date', 'z_timesheet_end_date',
+}
+
+# timer portal yang masih terbuka; baris timesheet biasa (backend / grid) tidak punya z_timer_state
+OPEN_TIMER_STATES = ('running', 'paused')
+OPEN_TIMER_DOMAIN = [('z_timesheet_end_date', '=', False), ('z_timer_state', 'in', OPEN_TIMER_STATES)]
+OPEN_TIMER_WHERE = "z_timesheet_end_date IS NULL AND z_timer_state IN ('running', 'paused')"
+
+
+class AccountAnalyticLine(models.Model):
+
+    _inherit = ["account.analytic.line"]
+
+    def init(self):
+        super().init()
+        # feed timesheet per task: urutan start date terbaru dulu, keyset (start date, id)
+        create_index(
+            self.env.cr,
+            'account_analytic_line_z_task_feed_idx',
+            self._table,
+            ['task_id', 'z_timesheet_start_date DESC NULLS LAST', 'id DESC'],
+            where='task_id IS NOT NULL',
+        )
+        self._init_running_timer_unique_index()
+
+    def _init_running_timer_unique_index(self):
+        """Satu timer terbuka per (task, employee); index ini juga registry timer berjalan.
+        Bila data lama masih duplikat: unique index dilewati (dengan warning), dipakai index biasa."""
+        cr = self.env.cr
+        # versi lama index mencakup semua baris tanpa end date (termasuk timesheet biasa)
+        cr.execute(SQL("DROP INDEX IF EXISTS account_analytic_line_z_running_timer_uniq"))
+        if index_exists(cr, 'account_analytic_line_z_open_timer_uniq'):
+            cr.execute(SQL("DROP INDEX IF EXISTS account_analytic_line_z_running_timer_idx"))
+            return
+        cr.execute(SQL("""
+            SELECT 1 FROM account_analytic_line
+             WHERE %s AND task_id IS NOT NULL
+          GROUP BY task_id, employee_id
+            HAVING count(*) > 1
+             LIMIT 1
+        """, SQL(OPEN_TIMER_WHERE)))
+        if cr.fetchone():
+            _logger.warning("Duplicate running timers found; account_analytic_line_z_open_timer_uniq not created. "
+                            "Stop the duplicate lines and upgrade the module again.")
+            create_index(
+                cr,
+                'account_analytic_line_z_running_timer_idx',
+                self._table,
+                ['task_id', 'employee_id'],
+                where=OPEN_TIMER_WHERE,
+            )
+            return
+        cr.execute(SQL("""
+            CREATE UNIQUE INDEX account_analytic_line_z_open_timer_uniq
+                ON account_analytic_line (task_id, employee_id)
+             WHERE %s AND task_id IS NOT NULL
+        """, SQL(OPEN_TIMER_WHERE)))
+        cr.execute(SQL("DROP INDEX IF EXISTS account_analytic_line_z_running_timer_idx"))
+
+    @api.model
+    def _portal_timer_lock(self, task, employee):
+        """Advisory lock transaksi untuk aksi timer (task, employee); dilepas saat commit / rollback."""
+        self.env.cr.execute(SQL(
+            "SELECT pg_advisory_xact_lock(hashtext(%s), %s)",
+            'z_portal_timer:%s' % task.id, employee.id,
+        ))
+
+    @api.model
+    def _portal_sql_written(self, line_ids, fnames):
+        """Setelah UPDATE SQL langsung: buang cache, picu compute tersimpan (unit_amount, dst.) & tandai task dirty."""
+        lines = self.sudo().browse(line_ids)
+        lines.invalidate_recordset(fnames)
+        lines.modified(fnames)
+        lines.flush_recordset()
+        lines.task_id._mark_portal_dirty()
+        return lines
+
+    @api.model
+    def _portal_timer_pause(self, task, employee):
+        """Pause timer terbuka yang sedang berjalan (satu UPDATE bersyarat). Return baris yang berubah."""
+        self.flush_model()
+        self.env.cr.execute(SQL("""
+            UPDATE account_analytic_line
+               SET z_is_paused = TRUE, z_pause_started_at = %s
+             WHERE task_id = %s AND employee_id = %s
+               AND %s AND z_is_paused IS NOT TRUE
+         RETURNING id
+        """, fields.Datetime.now(), task.id, employee.id, SQL(OPEN_TIMER_WHERE)))
+        return self._portal_sql_written([r[0] for r in self.env.cr.fetchall()],
+                                        ['z_is_paused', 'z_pause_started_at'])
+
+    @api.model
+    def _portal_timer_resume(self, task, employee):
+        """Resume timer yang sedang pause; durasi pause ditambahkan ke z_pause_accum_seconds."""
+        self.flush_model()
+        self.env.cr.execute(SQL("""
+            UPDATE account_analytic_line
+               SET z_pause_accum_seconds = COALESCE(z_pause_accum_seconds, 0) + CASE
+                       WHEN z_pause_started_at IS NOT NULL
+                       THEN GREATEST(0, floor(extract(epoch FROM %s - z_pause_started_at)))::int
+                       ELSE 0 END,
+                   z_is_paused = FALSE,
+                   z_pause_started_at = NULL
+             WHERE task_id = %s AND employee_id = %s
+               AND %s AND z_is_paused IS TRUE
+         RETURNING id
+        """, fields.Datetime.now(), task.id, employee.id, SQL(OPEN_TIMER_WHERE)))
+        return self._portal_sql_written([r[0] for r in self.env.cr.fetchall()],
+                                        ['z_pause_accum_seconds', 'z_is_paused', 'z_pause_started_at'])
+
+    @api.model
+    def _portal_timer_stop(self, task, employee, description):
+        """Stop timer terbuka (running / pause); pause yang masih berjalan diakumulasi sampai end date."""
+        self.flush_model()
+        now = fields.Datetime.now()
+        self.env.cr.execute(SQL("""
+            UPDATE account_analytic_line
+               SET z_pause_accum_seconds = COALESCE(z_pause_accum_seconds, 0) + CASE
+                       WHEN z_is_paused AND z_pause_started_at IS NOT NULL
+                       THEN GREATEST(0, floor(extract(epoch FROM %s - z_pause_started_at)))::int
+                       ELSE 0 END,
+                   z_is_paused = FALSE,
+                   z_pause_started_at = NULL,
+                   z_timesheet_end_date = %s,
+                   name = %s,
+                   z_timer_state = 'stopped',
+                   z_state = 'approved'
+             WHERE task_id = %s AND employee_id = %s
+               AND %s
+         RETURNING id
+        """, now, now, description, task.id, employee.id, SQL(OPEN_TIMER_WHERE)))
+        return self._portal_sql_written([r[0] for r in self.env.cr.fetchall()], [
+            'z_pause_accum_seconds', 'z_is_paused', 'z_pause_started_at',
+            'z_timesheet_end_date', 'name', 'z_timer_state', 'z_state',
+        ])
+
+    @api.model
+    def _portal_open_timer(self, task, employee):
+        """Baris timer portal yang masih terbuka (running / pause) untuk (task, employee)."""
+        return self.sudo().search([
+            ('task_id', '=', task.id),
+            ('employee_id', '=', employee.id),
+        ] + OPEN_TIMER_DOMAIN, order='id desc', limit=1)
+
+    @api.model
+    def _portal_timer_state(self, task, employee):
+        """State timer (task, employee) untuk seed halaman & push bus."""
+        line = self._portal_open_timer(task, employee)
+        start = line.z_timesheet_start_date
+        return {
+            'task_id': task.id,
+            'running': bool(line),
+            'paused': bool(line.z_is_paused),
+            'start_at': fields.Datetime.to_string(start) if start else '',
+            'timesheet_id': line.id or False,
+        }
+
+    @api.model
+    def _portal_notify_timer(self, task, employee, event):
+        """Push perubahan timer ke semua tab/perangkat user employee (bus, dikirim setelah commit)."""
+        partner = employee.user_id.partner_id
+        if partner:
+            self.env['bus.bus']._sendone(partner, 'z_portal_timer', dict(
+                self._portal_timer_state(task, employee), event=event))
+
+    @api.model
+    def _portal_feed_cursor(self, line):
+        start = line.z_timesheet_start_date
+        return '%s|%s' % (fields.Datetime.to_string(start) if start else '', line.id)
+
+    @api.model
+    def _portal_feed_domain_after(self, cursor):
+        """Domain keyset: baris setelah cursor "<start utc>|<id>" pada urutan start desc nulls last, id desc."""
+        try:
+            start_raw, line_id = (cursor or '').split('|', 1)
+            line_id = int(line_id)
+            start = fields.Datetime.to_datetime(start_raw) if start_raw else False
+        except (ValueError, TypeError):
+            return []
+        if not start:
+            return [('z_timesheet_start_date', '=', False), ('id', '<', line_id)]
+        return [
+            '|', '|',
+            ('z_timesheet_start_date', '<', start),
+            '&', ('z_timesheet_start_date', '=', start), ('id', '<', line_id),
+            ('z_timesheet_start_date', '=', False),
+        ]
+
+    @api.model
+    def _portal_timesheet_feed(self, task, employee=None, cursor=None, limit=5):
+        """Satu halaman timesheet task, diurutkan di database (start terbaru dulu).
+        employee: batasi ke timesheet milik employee tsb (restriksi self-only).
+        Return (lines, next_cursor); next_cursor False bila tidak ada halaman berikutnya."""
+        domain = [('task_id', '=', task.id)]
+        if employee is not None:
+            domain.append(('employee_id', '=', employee.id))
+        if cursor:
+            domain += self._portal_feed_domain_after(cursor)
+        lines = self.sudo().search(domain, order='z_timesheet_start_date desc nulls last, id desc', limit=limit + 1)
+        has_more = len(lines) > limit
+        lines = lines[:limit]
+        next_cursor = self._portal_feed_cursor(lines[-1]) if has_more else False
+        return lines, next_cursor
+
+    @api.model
+    def _portal_timesheet_feed_batch(self, tasks, employee=None, limit=5):
+        """Halaman pertama feed timesheet untuk banyak task dalam satu query (row_number per task).
+        Return {task_id: (lines, next_cursor)}; urutan & cursor sama dengan _portal_timesheet_feed."""
+        if not tasks:
+            return {}
+        domain = [('task_id', 'in', tasks.ids)]
+        if employee is not None:
+            domain.append(('employee_id', '=', employee.id))
+        matched = self.sudo()._search(domain).select(
+            SQL.identifier(self._table, 'id'),
+            SQL.identifier(self._table, 'task_id'),
+            SQL.identifier(self._table, 'z_timesheet_start_date'),
+        )
+        self.env.cr.execute(SQL("""
+            SELECT r.task_id, r.id
+              FROM (
+                    SELECT m.id, m.task_id,
+                           row_number() OVER (
+                               PARTITION BY m.task_id ORDER BY m.start_date DESC NULLS LAST, m.id DESC
+                           ) AS rn
+                      FROM (%s) m(id, task_id, start_date)
+                   ) r
+             WHERE r.rn <= %s
+          ORDER BY r.task_id, r.rn
+        """, matched, limit + 1))
+        ids_by_task = defaultdict(list)
+        for task_id, line_id in self.env.cr.fetchall():
+            ids_by_task[task_id].append(line_id)
+        all_lines = self.sudo().browse([lid for ids in ids_by_task.values() for lid in ids])
+        result = {}
+        for task_id, ids in ids_by_task.items():
+            lines = self.sudo().browse(ids[:limit]).with_prefetch(all_lines._prefetch_ids)
+            result[task_id] = (lines, self._portal_feed_cursor(lines[-1]) if len(ids) > limit else False)
+        return result
+
+    @api.model
+    def _cron_autostop_stale_timers(self, batch_size=1000, max_batches=50):
+        """Tutup timer terbuka (running / pause) yang melewati batas jam per company.
+        End date = start + batas jam; pause yang masih berjalan diakumulasi sampai end date (sama seperti resume).
+        Update dilakukan set-based per batch, satu ringkasan chatter per employee.
+        Baris berstatus waiting_approval dan mendapat request correction (jam hasil auto-stop) untuk direview approver;
+        user terkait mendapat notifikasi bus agar badge / tombol timer di portal ikut berhenti."""
+        stopped_by_employee = defaultdict(list)
+        for _batch in range(max_batches):
+            self.env.flush_all()
+            self.env.cr.execute(SQL("""
+                WITH stale AS (
+                    SELECT l.id,
+                           l.z_timesheet_start_date + make_interval(hours => c.z_timer_autostop_hours) AS end_at
+                      FROM account_analytic_line l
+                      JOIN res_company c ON c.id = l.company_id
+                     WHERE l.z_timesheet_end_date IS NULL
+                       AND l.z_timer_state IN ('running', 'paused')
+                       AND l.task_id IS NOT NULL
+                       AND l.z_timesheet_start_date IS NOT NULL
+                       AND c.z_timer_autostop_hours > 0
+                       AND l.z_timesheet_start_date
+                           < (now() AT TIME ZONE 'UTC') - make_interval(hours => c.z_timer_autostop_hours)
+                  ORDER BY l.id
+                     LIMIT %s
+                       FOR UPDATE OF l SKIP LOCKED
+                )
+                UPDATE account_analytic_line l
+                   SET z_pause_accum_seconds = COALESCE(l.z_pause_accum_seconds, 0) + CASE
+                           WHEN l.z_is_paused AND l.z_pause_started_at IS NOT NULL
+                           THEN GREATEST(0, floor(extract(epoch FROM stale.end_at - l.z_pause_started_at)))::int
+                           ELSE 0 END,
+                       z_is_paused = FALSE,
+                       z_pause_started_at = NULL,
+                       z_timesheet_end_date = stale.end_at,
+                       z_timer_state = 'stopped',
+                       z_state = 'waiting_approval'
+                  FROM stale
+                 WHERE l.id = stale.id
+             RETURNING l.id, l.employee_id
+            """, batch_size))
+            rows = self.env.cr.fetchall()
+            if not rows:
+                break
+            lines = self._portal_sql_written([line_id for line_id, _employee_id in rows], [
+                'z_pause_accum_seconds', 'z_is_paused', 'z_pause_started_at',
+                'z_timesheet_end_date', 'z_timer_state', 'z_state',
+            ])
+            self._create_autostop_requests(lines)
+            for line_id, employee_id in rows:
+                if employee_id:
+                    stopped_by_employee[employee_id].append(line_id)
+            # tab portal yang masih membuka timer ini ikut berhenti (satu notifikasi per task & employee)
+            for task, employee in {(line.task_id, line.employee_id) for line in lines if line.employee_id}:
+                self._portal_notify_timer(task, employee, 'autostop')
+            if len(rows) < batch_size:
+                break
+
+        for employee in self.env['hr.employee'].sudo().browse(list(stopped_by_employee)):
+            lines = self.sudo().browse(stopped_by_employee[employee.id])
+            task_names = ', '.join(sorted(set(lines.task_id.mapped('display_name'))))
+            employee.message_post(body='%s timer dihentikan otomatis (melewati batas jam): %s' % (
+                len(lines), task_names))
+        return True
+
+    def _create_autostop_requests(self, lines):
+        """Request correction per baris hasil auto-stop, agar muncul di alur approval (inbox / per task)."""
+        self.env['account.analytic.line.request'].sudo().create([{
+            'z_request_type': 'correction',
+            'z_timesheet_id': line.id,
+            'z_task_id': line.task_id.id,
+            'z_employee_id': line.employee_id.id,
+            'z_name': line.name,
+            'z_current_start_date': line.z_timesheet_start_date,
+            'z_current_end_date': line.z_timesheet_end_date,
+            'z_ori_start_date': line.z_timesheet_start_date,
+            'z_ori_end_date': line.z_timesheet_end_date,
+            'z_state': 'waiting_approval',
+        } for line in lines])
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records.task_id._mark_portal_dirty()
+        return records
+
+    def write(self, vals):
+        old_tasks = self.task_id if 'task_id' in vals else self.env['project.task']
+        res = super().write(vals)
+        dirty_fields = TASK_DIRTY_FIELDS | self.env['project.task']._portal_dirty_fields(self._name)
+        if dirty_fields.intersection(vals):
+            (self.task_id | old_tasks)._mark_portal_dirty()
+        return res
+
+    def unlink(self):
+        tasks = self.task_id
+        res = super().unlink()
+        tasks.exists()._mark_portal_dirty()
+        return res
+
+
+class PortalTimerRequest(models.Model):
+
+    _name = "z.portal.timer.request"
+    _description = "Portal Timer Request (Idempotency)"
+    _log_access = False
+
+    z_key = fields.Char(string='Request Key', required=True)
+    z_user_id = fields.Many2one('res.users', string='User', required=True, ondelete='cascade')
+    z_task_id = fields.Many2one('project.task', string='Task', ondelete='cascade')
+    z_action = fields.Char(string='Action')
+    z_response = fields.Text(string='Response')
+    z_create_date = fields.Datetime(string='Created On', default=fields.Datetime.now, index=True)
+
+    _sql_constraints = [
+        ('z_key_user_uniq', 'unique(z_key, z_user_id)', 'Request key sudah dipakai.'),
+    ]
+
+    @api.model
+    def _claim_key(self, key, user, task, action):
+        """Klaim request_key sebelum aksi timer dijalankan. True = key baru (aksi boleh dijalankan).
+        Key yang sedang dipegang transaksi lain membuat INSERT menunggu; bila transaksi itu commit setelah
+        snapshot ini, PostgreSQL (REPEATABLE READ) melempar serialization failure dan Odoo mengulang request."""
+        self.env.cr.execute(SQL("""
+            INSERT INTO z_portal_timer_request (z_key, z_user_id, z_task_id, z_action, z_create_date)
+            VALUES (%s, %s, %s, %s, now() AT TIME ZONE 'UTC')
+            ON CONFLICT (z_key, z_user_id) DO NOTHING
+            RETURNING id
+        """, key, user.id, task.id, action))
+        return bool(self.env.cr.fetchone())
+
+    @api.model
+    def _get_response(self, key, user):
+        """Respons tersimpan untuk request_key ini (klik ulang / retry jaringan), atau None."""
+        rec = self.search([('z_key', '=', key), ('z_user_id', '=', user.id)], limit=1)
+        return rec.z_response if rec else None
+
+    @api.model
+    def _store_response(self, key, user, response):
+        self.env.cr.execute(SQL(
+            "UPDATE z_portal_timer_request SET z_response = %s WHERE z_key = %s AND z_user_id = %s",
+            response, key, user.id,
+        ))
+
+    @api.autovacuum
+    def _gc_timer_requests(self):
+        limit_date = fields.Datetime.now() - timedelta(days=2)
+        self.search([('z_create_date', '<', limit_date)]).unlink()
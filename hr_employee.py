@@ -0,0 +1,27 @@
+from odoo import models, fields, api
+
+
+class HrEmployee(models.Model):
+
+    _inherit = ["hr.employee"]
+
+    # override: index trigram untuk autocomplete portal
+    name = fields.Char(index='trigram')
+
+    # invalidasi konteks user portal (res.users._get_portal_context_data) lewat versi cache hr.employee
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env['z.portal.cache.version']._bump(self._name)
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        if {'active', 'user_id', 'parent_id'} & set(vals):
+            self.env['z.portal.cache.version']._bump(self._name)
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env['z.portal.cache.version']._bump(self._name)
+        return res
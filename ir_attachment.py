@@ -0,0 +1,101 @@
+from odoo import models, api
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import SQL
+import filecmp
+import hashlib
+import logging
+import os
+import tempfile
+
+_logger = logging.getLogger(__name__)
+
+# ukuran chunk saat menyalin upload ke filestore
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# default batas upload portal (bisa diubah lewat System Parameters)
+DEFAULT_UPLOAD_MAX_BYTES = 25 * 1024 * 1024
+DEFAULT_UPLOAD_MAX_TOTAL_BYTES = 100 * 1024 * 1024
+
+
+class IrAttachment(models.Model):
+
+    _inherit = ["ir.attachment"]
+
+    @api.model
+    def _get_portal_upload_limits(self):
+        """(maks per file, maks total per request) dalam byte, dari ir.config_parameter."""
+        ICP = self.env['ir.config_parameter'].sudo()
+
+        def _int_param(key, default):
+            try:
+                return int(ICP.get_param(key, default))
+            except (TypeError, ValueError):
+                return default
+
+        return (
+            _int_param('z_project.portal_upload_max_bytes', DEFAULT_UPLOAD_MAX_BYTES),
+            _int_param('z_project.portal_upload_max_total_bytes', DEFAULT_UPLOAD_MAX_TOTAL_BYTES),
+        )
+
+    @api.model
+    def _create_from_upload_stream(self, stream, filename, mimetype, res_model, res_id, max_bytes):
+        """Buat attachment dari stream upload tanpa memuat seluruh isi file ke memory.
+        Storage filestore: chunk disalin langsung ke file sementara di filestore (sha1 dihitung sambil jalan),
+        lalu di-rename ke path checksum. Storage lain (db): dibaca dengan batas max_bytes.
+        Raise ValidationError bila file melebihi max_bytes."""
+        vals = {
+            'name': filename,
+            'type': 'binary',
+            'res_model': res_model,
+            'res_id': res_id,
+            'mimetype': mimetype or 'application/octet-stream',
+            'public': False,
+        }
+        if self._storage() != 'file':
+            content = stream.read(max_bytes + 1)
+            if len(content) > max_bytes:
+                raise ValidationError('File %s melebihi batas ukuran upload.' % filename)
+            return self.create(dict(vals, raw=content))
+
+        sha = hashlib.sha1()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(prefix='upload-', dir=self._filestore())
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ValidationError('File %s melebihi batas ukuran upload.' % filename)
+                    sha.update(chunk)
+                    tmp.write(chunk)
+            checksum = sha.hexdigest()
+            # path filestore dibangun sendiri (layout sama dengan _get_path), karena _get_path
+            # membandingkan isi file lama dengan bin_data yang di sini tidak dimuat ke memory
+            fname = checksum[:2] + '/' + checksum
+            full_path = self._full_path(fname)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if os.path.exists(full_path):
+                # isi sama sudah ada di filestore (dedup by checksum)
+                if not filecmp.cmp(tmp_path, full_path, shallow=False):
+                    raise UserError("The attachment collides with an existing file.")
+                os.unlink(tmp_path)
+            else:
+                os.replace(tmp_path, full_path)
+                # hapus lagi oleh GC bila transaksi batal
+                self._mark_for_gc(fname)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        # create() membuang store_fname / file_size / checksum dari vals: record dibuat tanpa isi,
+        # lalu kolom storage diisi langsung (file sudah ada di filestore, tidak ditulis ulang)
+        attachment = self.create(vals)
+        self.env.cr.execute(SQL(
+            "UPDATE ir_attachment SET store_fname = %s, file_size = %s, checksum = %s, db_datas = NULL WHERE id = %s",
+            fname, size, checksum, attachment.id,
+        ))
+        attachment.invalidate_recordset(['store_fname', 'file_size', 'checksum', 'db_datas', 'raw', 'datas'])
+        return attachment
@@ -0,0 +1,186 @@
+from odoo import models, fields, api, tools
+from odoo.tools import SQL
+from collections import namedtuple
+import os
+
+ReferenceItem = namedtuple('ReferenceItem', ['id', 'name'])
+
+# counter per worker (tiap proses punya cache & counter sendiri); hit = calls - misses
+REFERENCE_CACHE_STATS = {'calls': 0, 'misses': 0}
+
+# master data yang di-cache get_reference_data; task.master & hr.employee punya cache sendiri
+REFERENCE_DATA_MODELS = ('technology.used', 'severity.master', 'area.regional')
+
+
+class PortalCacheVersion(models.Model):
+
+    _name = "z.portal.cache.version"
+    _description = "Portal Cache Version"
+    _log_access = False
+
+    z_key = fields.Char(string='Key', required=True)
+    z_version = fields.Integer(string='Version', default=0)
+
+    _sql_constraints = [
+        ('z_key_uniq', 'unique(z_key)', 'Key versi cache sudah ada.'),
+    ]
+
+    @api.model
+    def _get_versions(self, keys):
+        """Versi per key (urutan sama dengan keys), dipakai sebagai bagian key ormcache."""
+        self.env.cr.execute(SQL(
+            "SELECT z_key, z_version FROM z_portal_cache_version WHERE z_key = ANY(%s)", list(keys),
+        ))
+        versions = dict(self.env.cr.fetchall())
+        return tuple(versions.get(k, 0) for k in keys)
+
+    @api.model
+    def _bump(self, key):
+        """Naikkan versi key: ikut commit / rollback bersama perubahan datanya, dan hanya cache
+        yang memakai key ini yang berganti (tanpa registry.clear_cache untuk seluruh worker)."""
+        self.env.cr.execute(SQL("""
+            INSERT INTO z_portal_cache_version (z_key, z_version) VALUES (%s, 1)
+            ON CONFLICT (z_key) DO UPDATE SET z_version = z_portal_cache_version.z_version + 1
+        """, key))
+
+
+class PortalReferenceData(models.AbstractModel):
+
+    _name = "z.portal.reference.data"
+    _description = "Portal Reference Data"
+
+    @api.model
+    def get_reference_data(self):
+        """Master data untuk form portal dalam bentuk tuple (id, name), cache per worker."""
+        REFERENCE_CACHE_STATS['calls'] += 1
+        return self._get_reference_data(self.env['z.portal.cache.version']._get_versions(REFERENCE_DATA_MODELS))
+
+    @api.model
+    @tools.ormcache('versions')
+    def _get_reference_data(self, versions):
+        REFERENCE_CACHE_STATS['misses'] += 1
+        env = self.sudo().env
+
+        def _items(model, name_getter):
+            return tuple(ReferenceItem(r.id, name_getter(r) or '') for r in env[model].search([]))
+
+        return {
+            'technologies': _items('technology.used', lambda r: r.z_name),
+            'severities': _items('severity.master', lambda r: r.z_name),
+            'regionals': _items('area.regional', lambda r: r.z_name),
+        }
+
+    @api.model
+    def get_cache_stats(self):
+        """Statistik cache worker yang melayani request ini saja, bukan agregat seluruh server."""
+        calls = REFERENCE_CACHE_STATS['calls']
+        misses = REFERENCE_CACHE_STATS['misses']
+        return {'scope': 'worker', 'worker_pid': os.getpid(), 'calls': calls, 'hits': calls - misses, 'misses': misses}
+
+
+class PortalReferenceDataInvalidate(models.AbstractModel):
+
+    _name = "z.portal.reference.data.invalidate"
+    _description = "Portal Reference Data Invalidation"
+
+    # invalidasi lewat versi per model (z.portal.cache.version), bukan registry.clear_cache
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env['z.portal.cache.version']._bump(self._name)
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env['z.portal.cache.version']._bump(self._name)
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env['z.portal.cache.version']._bump(self._name)
+        return res
+
+
+class TaskMaster(models.Model):
+
+    _name = "task.master"
+    _inherit = ["task.master", "z.portal.reference.data.invalidate"]
+
+    @api.model
+    def _get_master_tree(self):
+        """Hierarki master task per worker: {'roots': ids, 'parent': {id: parent}, 'children': {id: ids}}.
+        Urutan mengikuti _order model; invalidasi lewat z.portal.reference.data.invalidate. Jangan dimutasi."""
+        return self._get_master_tree_cached(self.env['z.portal.cache.version']._get_versions([self._name]))
+
+    @api.model
+    @tools.ormcache('versions')
+    def _get_master_tree_cached(self, versions):
+        rows = self.sudo().search_read([], ['z_parent_id'], load=False)
+        known = {r['id'] for r in rows}
+        parent = {}
+        children = {}
+        roots = []
+        for r in rows:
+            pid = r['z_parent_id'] if r['z_parent_id'] in known else False
+            parent[r['id']] = pid
+            if pid:
+                children.setdefault(pid, []).append(r['id'])
+            else:
+                roots.append(r['id'])
+        return {
+            'roots': tuple(roots),
+            'parent': parent,
+            'children': {k: tuple(v) for k, v in children.items()},
+        }
+
+    @api.model
+    def _master_roots(self):
+        return self.browse(self._get_master_tree()['roots'])
+
+    @api.model
+    def _master_children(self, master_id):
+        return self.browse(self._get_master_tree()['children'].get(master_id, ()))
+
+    @api.model
+    def _master_root_of(self, master_id):
+        parent = self._get_master_tree()['parent']
+        cur = master_id
+        seen = set()
+        while parent.get(cur) and cur not in seen:
+            seen.add(cur)
+            cur = parent[cur]
+        return self.browse(cur)
+
+    @api.model
+    def _master_subtree(self, master_id):
+        """master_id beserta seluruh turunannya (pre-order)."""
+        children = self._get_master_tree()['children']
+        result = []
+        seen = set()
+        stack = [master_id]
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            result.append(node)
+            stack.extend(reversed(children.get(node, ())))
+        return self.browse(result)
+
+
+class TechnologyUsed(models.Model):
+
+    _name = "technology.used"
+    _inherit = ["technology.used", "z.portal.reference.data.invalidate"]
+
+
+class SeverityMaster(models.Model):
+
+    _name = "severity.master"
+    _inherit = ["severity.master", "z.portal.reference.data.invalidate"]
+
+
+class AreaRegional(models.Model):
+
+    _name = "area.regional"
+    _inherit = ["area.regional", "z.portal.reference.data.invalidate"]
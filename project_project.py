@@ -356,6 +356,14 @@ class ProjectProject(models.Model):
             print("❌ Connection error:", e)
 
 
+class ProjectTags(models.Model):
+
+    _inherit = ["project.tags"]
+
+    # override: index trigram untuk autocomplete portal
+    name = fields.Char(index='trigram')
+
+
 class ProjectProjectProjectTeams(models.Model):
 
     _name = "project.project.project.teams"
@@ -392,6 +400,31 @@ class ProjectProjectProjectTeams(models.Model):
     z_job2_bobot = fields.Float(string='Bobot (%)',related='z_job2_id.z_bobot',store=True)
     z_bobot = fields.Float(string='Bobot (%)',compute=_getBobot,store=True)
 
+    # perubahan team mempengaruhi project team & bobot pada task project terkait
+    def _mark_project_tasks_dirty(self, projects):
+        if projects:
+            tasks = self.env['project.task'].sudo().search([('project_id', 'in', projects.ids)])
+            # project besar: cukup ditandai, dihitung cron per batch (bukan di request yang menyimpan team)
+            tasks._mark_portal_dirty(defer=len(tasks) > tasks._portal_dirty_sync_limit)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self._mark_project_tasks_dirty(records.z_project_teams_project_id)
+        return records
+
+    def write(self, vals):
+        projects = self.z_project_teams_project_id
+        res = super().write(vals)
+        self._mark_project_tasks_dirty(projects | self.z_project_teams_project_id)
+        return res
+
+    def unlink(self):
+        projects = self.z_project_teams_project_id
+        res = super().unlink()
+        self._mark_project_tasks_dirty(projects.exists())
+        return res
+
 
 class ProjectProjectProgramName(models.Model):
 
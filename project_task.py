@@ -1,15 +1,18 @@
 from odoo import http, fields, tools
 from odoo.http import request, Response
 from odoo.addons.portal.controllers.portal import pager
+from odoo.tools import SQL
 from datetime import datetime
 import pytz
 import json
 import logging
 import re
 from html import unescape
-import base64
+import psycopg2
+import psycopg2.errors
 from odoo.osv import expression
 from urllib.parse import urlencode
+from collections import defaultdict
 
 _logger = logging.getLogger(__name__)
 WIB = pytz.timezone('Asia/Jakarta')  # default fallback
@@ -84,6 +87,40 @@ def _to_wib(dt_val, with_seconds=False):
     return d.strftime(fmt)
 
 
+class PortalContext(object):
+    """Konteks user portal untuk satu request: employee, role flags, bawahan langsung & keanggotaan team.
+    Data dasarnya di-cache per user lintas request (res.users._get_portal_context_data);
+    anggota Project Teams per project di-memo selama request."""
+
+    def __init__(self, env, data, flags):
+        self.env = env
+        self._team_employees = {}
+        self.flags = flags
+        self.is_portal = data['is_portal']
+        self.employee = env['hr.employee'].sudo().browse(data['employee_id'])
+        self.manager_id = data['manager_id']
+        self.subordinate_ids = frozenset(data['subordinate_ids'])
+
+    def is_manager_of(self, employee):
+        """True bila employee adalah bawahan langsung user ini."""
+        return bool(employee) and employee.id in self.subordinate_ids
+
+    def project_team_employees(self, project):
+        """Employee anggota Project Teams project (dihitung sekali per project per request)."""
+        Employee = self.env['hr.employee'].sudo()
+        if not project:
+            return Employee.browse()
+        if project.id not in self._team_employees:
+            employees = Employee.browse()
+            team_lines = getattr(project, 'z_project_teams2_ids', False) or getattr(project, 'z_project_teams_ids', False)
+            if team_lines:
+                for f in ('z_project_teams_employee_id', 'employee_id', 'z_employee_id'):
+                    if any(hasattr(line, f) for line in team_lines):
+                        employees |= team_lines.mapped(f)
+            self._team_employees[project.id] = employees.exists()
+        return self._team_employees[project.id]
+
+
 class PortalProjectControllers(http.Controller):
 
     # ================= MASTER TASK HELPERS =================
@@ -91,26 +128,14 @@ class PortalProjectControllers(http.Controller):
         """Naik ke master paling atas (z_parent_id = False)."""
         if not rec:
             return rec
-        cur = rec
-        while getattr(cur, 'z_parent_id', False):
-            cur = cur.z_parent_id
-        return cur
+        return request.env['task.master'].sudo()._master_root_of(rec.id)
 
     def _gather_master_tree(self, root):
         """(Masih tersedia jika dibutuhkan untuk mode lama)"""
         Master = request.env['task.master'].sudo()
         if not root:
             return Master.browse()
-        result = root
-        stack = [root]
-        while stack:
-            node = stack.pop()
-            children = Master.search([('z_parent_id', '=', node.id)])
-            for ch in children:
-                if ch not in result:
-                    result |= ch
-                    stack.append(ch)
-        return result
+        return Master._master_subtree(root.id)
 
     # ---------------- ROLE FLAGS (UPDATED) ----------------
     def _role_flags(self):
@@ -118,135 +143,37 @@ class PortalProjectControllers(http.Controller):
         if hasattr(request, cache_key):
             return getattr(request, cache_key)
 
-        user = request.env.user
-        is_internal_super = user.has_group('base.group_user') and not user.has_group('base.group_portal')
-        group_rec = getattr(user, 'z_project_group_id', False)
-        group_name = group_rec.name if group_rec else ''
-
-        name_map = {
-            'Projects: Administrator': 'project_admin',
-            'Projects: Project Manager': 'project_manager',
-            'Projects: Head': 'project_head',
-            'Projects: Staff': 'project_engineer',
-            'Projects: Staff Engineer': 'project_engineer',
-            'Projects: Staff Support': 'project_delivery_support',
-            'Projects: Readonly': 'project_readonly',
-            'Projects: Head Engineer': 'project_head',
-            'Projects: Delivery Support': 'project_delivery_support',
-        }
-        ga = name_map.get(group_name)
-
-        if not ga and group_rec:
-            try:
-                xmlid_full = group_rec.get_external_id().get(group_rec.id)
-            except Exception:
-                xmlid_full = None
-            if xmlid_full:
-                suffix_map = {
-                    '_project_manager': 'project_manager',
-                    '_lead': 'project_head',
-                    '_head_engineer': 'project_head',
-                    '_user': 'project_engineer',
-                    '_readonly': 'project_delivery_support',
-                }
-                for suf, code in suffix_map.items():
-                    if xmlid_full.endswith(suf):
-                        ga = code
-                        break
-
-        if is_internal_super and not ga:
-            ga = 'project_admin'
-
-        is_admin = (ga == 'project_admin')
-        is_pm = (ga == 'project_manager')
-        is_head = (ga == 'project_head')
-        is_engineer = (ga == 'project_engineer')
-        is_delivery = (ga == 'project_delivery_support')
-        is_readonly = (ga == 'project_readonly')
-
-        is_head_engineer = is_head
-
-        # Permissions
-        can_approve_timesheet = (is_admin or is_pm or is_head)
-        can_submit_task = (is_admin or is_pm or is_head or is_engineer)
-        can_approve_task = (is_admin or is_pm)
-        can_reject_task = (is_admin or is_pm or is_head)
-        can_finish_task = (is_admin or is_pm)
-        can_update_task = (is_admin or is_pm or is_head) and not is_readonly
-        can_view_project_page = (is_admin or is_pm)
-
-        flags = {
-            'groups_access': ga,
-            'is_internal_super': is_internal_super,
-
-            'is_admin': is_admin,
-            'is_pm': (is_pm or is_admin),
-
-            'is_head': is_head,
-            'is_head_engineer': is_head_engineer,
-
-            'is_engineer': is_engineer,
-            'is_delivery_support': is_delivery,
-
-            'is_readonly_user': is_readonly,
-
-            'is_support': is_delivery or is_readonly,
-            'is_staff': is_engineer or is_delivery,
-
-            'can_create_task': (is_admin or is_pm),
-            'can_update_task': can_update_task,
-            'can_delete_task': (is_admin or is_pm) and not is_readonly,
-            'can_submit_task': can_submit_task and not is_readonly,
-            'can_approve_task': can_approve_task and not is_readonly,
-            'can_reject_task': can_reject_task and not is_readonly,
-            'can_finish_task': can_finish_task and not is_readonly,
-            'can_create_subtask': (is_admin or is_pm or is_head) and not is_readonly,
-            'can_delete_subtask': (is_admin or is_pm) and not is_readonly,
-
-            'can_approve_timesheet': can_approve_timesheet,
-            'can_delete_timesheet': can_approve_timesheet and not is_readonly,
-
-            # Engineer/Delivery/Readonly dibatasi melihat timesheet sendiri,
-            'restrict_timesheet_to_self': (is_engineer or is_delivery or is_readonly) and not (
-                        is_admin or is_pm or is_head),
-            'show_tab_invoice_plan': (is_admin or is_pm or is_head or is_delivery or is_readonly or is_internal_super),
-            'can_edit_invoice_plan': (is_admin or is_pm) and not is_readonly,
-
-            'show_tab_description': (is_admin or is_pm or is_head) and not is_readonly,
-            'show_tab_subtasks': (is_admin or is_pm or is_head) and not is_readonly,
-            'show_metrics': (is_admin or is_pm or is_head) and not is_readonly,
-            'show_quality': (is_admin or is_pm or is_head) and not is_readonly,
-
-            'can_view_project_page': can_view_project_page,
-        }
+        # dihitung sekali per user lintas request (res.users._get_portal_role_flags, ormcache)
+        flags = dict(request.env.user._get_portal_role_flags())
         setattr(request, cache_key, flags)
         return flags
 
+    def _portal_ctx(self):
+        cache_key = '_z_portal_context'
+        if hasattr(request, cache_key):
+            return getattr(request, cache_key)
+        ctx = PortalContext(request.env, request.env.user._get_portal_context_data(), self._role_flags())
+        setattr(request, cache_key, ctx)
+        return ctx
+
     # ---------------- COMMON DATA ----------------
     def _common_data(self):
-        env = request.env
-        return {
-            'master_tasks': env['task.master'].sudo().search([]),
-            'employees': env['hr.employee'].sudo().search([]),
-            'technologies': env['technology.used'].sudo().search([]),
-            'severities': env['severity.master'].sudo().search([]),
-            'regionals': env['area.regional'].sudo().search([]),
-        }
+        """Tuple (id, name) master data (technology, severity, regional), di-cache per worker & diinvalidasi saat master berubah.
+        Employee & master task difilter per task di form, tidak diambil dari sini."""
+        return request.env['z.portal.reference.data'].sudo().get_reference_data()
+
+    @http.route('/portal/reference-cache/stats', type='http', auth='user', methods=['GET'])
+    def portal_reference_cache_stats(self, **kw):
+        """Hit / miss cache master data untuk worker yang melayani request ini (bukan agregat server)."""
+        flags = self._role_flags()
+        if not (flags.get('is_admin') or request.env.user.has_group('base.group_system')):
+            return Response(json.dumps({'success': False, 'error': 'Not allowed'}), content_type='application/json')
+        stats = request.env['z.portal.reference.data'].sudo().get_cache_stats()
+        return Response(json.dumps({'success': True, **stats}), content_type='application/json')
 
     # ---------------- PROJECT TEAMS EMPLOYEES ----------------
     def _get_project_team_employees(self, project):
-        Employee = request.env['hr.employee'].sudo()
-        if not project:
-            return Employee.browse()
-        team_lines = getattr(project, 'z_project_teams2_ids', False) or getattr(project, 'z_project_teams_ids', False)
-        if not team_lines:
-            return Employee.browse()
-        candidate_fields = ['z_project_teams_employee_id', 'employee_id', 'z_employee_id']
-        employees = Employee.browse()
-        for f in candidate_fields:
-            if any(hasattr(line, f) for line in team_lines):
-                employees |= team_lines.mapped(f)
-        return employees.exists()
+        return self._portal_ctx().project_team_employees(project)
 
     # ---------------- UTIL TEXT ----------------
     def _convert_html_to_text(self, html_content):
@@ -257,111 +184,297 @@ class PortalProjectControllers(http.Controller):
         txt = re.sub(r'<[^>]+>', '', txt)
         return unescape("\n".join([l.rstrip() for l in txt.splitlines()]).strip())
 
-    def _extract_employee_ids(self, record):
-        emp_ids = set()
-        emp = getattr(record, 'z_employee_id', False)
-        if emp:
-            emp_ids.add(emp.id)
-        ts = getattr(record, 'z_timesheet_id', False)
-        if ts and getattr(ts, 'employee_id', False):
-            emp_ids.add(ts.employee_id.id)
-        lines = getattr(record, 'z_line_ids', False)
-        if lines:
-            for line in lines:
-                le = getattr(line, 'z_employee_id', False) or getattr(line, 'employee_id', False)
-                if le:
-                    emp_ids.add(le.id)
-        return emp_ids
-
-    def _filter_requests_by_role(self, recs, task, flags, employee):
+    def _request_employee_domain(self, Req, employee_ids):
+        """Domain request milik salah satu employee: pemohon, pemilik timesheet, atau employee di baris request."""
+        employee_ids = list(employee_ids)
+        parts = [
+            [('z_employee_id', 'in', employee_ids)],
+            [('z_timesheet_id.employee_id', 'in', employee_ids)],
+        ]
+        line_field = Req._fields.get('z_line_ids')
+        if line_field:
+            Line = request.env[line_field.comodel_name]
+            # baris bisa membawa salah satu field employee; keduanya dicek
+            for f in ('z_employee_id', 'employee_id'):
+                if f in Line._fields:
+                    parts.append([('z_line_ids.%s' % f, 'in', employee_ids)])
+        return expression.OR(parts)
+
+    def _request_role_domain(self, Req, task, flags, employee):
+        """Restriksi request sesuai role viewer, dalam bentuk domain (dievaluasi di database)."""
         # PM/Admin/Head Engineer melihat semua
         if flags['can_approve_timesheet']:
-            return recs
+            return []
 
+        parts = []
         # Khusus Others: izinkan atasan langsung melihat request bawahannya
-        recs_manager = recs.browse()
         if task.z_type_non_project == 'others' and employee:
-            recs_manager = recs.filtered(
-                lambda r:
-                (r.z_employee_id and r.z_employee_id.parent_id and r.z_employee_id.parent_id.id == employee.id)
-                or
-                (r.z_timesheet_id and r.z_timesheet_id.employee_id
-                 and r.z_timesheet_id.employee_id.parent_id
-                 and r.z_timesheet_id.employee_id.parent_id.id == employee.id)
-            )
+            subordinate_ids = self._portal_ctx().subordinate_ids
+            if subordinate_ids:
+                parts.append([
+                    '|', ('z_employee_id', 'in', list(subordinate_ids)),
+                    ('z_timesheet_id.employee_id', 'in', list(subordinate_ids)),
+                ])
 
         # Head Engineer: yang terkait assignee task
-        assignees = (task.z_head_assignes_ids | task.z_member_assignes_ids)
-        recs_headeng = recs.filtered(lambda r: bool(self._extract_employee_ids(r) & set(assignees.ids))) if flags[
-            'is_head_engineer'] else recs.browse()
+        if flags['is_head_engineer']:
+            assignees = (task.z_head_assignes_ids | task.z_member_assignes_ids)
+            if assignees:
+                parts.append(self._request_employee_domain(Req, assignees.ids))
 
         # Engineer/Delivery/Readonly: hanya milik sendiri
-        recs_self = recs.filtered(lambda r: employee.id in self._extract_employee_ids(r)) if (flags['is_engineer'] or
-                                                                                              flags[
-                                                                                                  'is_support']) and employee else recs.browse()
-
-        return (recs_manager | recs_headeng | recs_self)
+        if (flags['is_engineer'] or flags['is_support']) and employee:
+            parts.append(self._request_employee_domain(Req, [employee.id]))
+
+        return expression.OR(parts) if parts else [('id', '=', 0)]
+
+    def _request_history(self, task, flags, employee, limit_hist=20):
+        """Riwayat request timesheet task dalam satu query: pending (semua), approved & rejected (limit_hist terbaru).
+        Return (pending, approved, rejected) sebagai recordset dengan prefetch bersama."""
+        Req = request.env['account.analytic.line.request'].sudo()
+        domain = expression.AND([
+            ['|', ('z_task_id', '=', task.id), ('z_timesheet_id.task_id', '=', task.id)],
+            [('z_state', 'in', ('waiting_approval', 'approved', 'rejected'))],
+            self._request_role_domain(Req, task, flags, employee),
+        ])
+        # pending mengikuti urutan default model (_order), riwayat approved/rejected terbaru dulu
+        query = Req._search(domain, order=Req._order)
+        default_order = SQL("(ORDER BY %s)", query.order)
+        query.order = None
+        matched = query.select(
+            SQL.identifier(Req._table, 'id'),
+            SQL.identifier(Req._table, 'z_state'),
+            SQL("row_number() OVER %s", default_order),
+        )
+        request.env.cr.execute(SQL("""
+            SELECT r.id, r.z_state
+              FROM (
+                    SELECT m.id, m.z_state, m.pos,
+                           row_number() OVER (PARTITION BY m.z_state ORDER BY m.id DESC) AS rn
+                      FROM (%s) m(id, z_state, pos)
+                   ) r
+             WHERE r.z_state = 'waiting_approval' OR r.rn <= %s
+          ORDER BY CASE WHEN r.z_state = 'waiting_approval' THEN r.pos END, r.id DESC
+        """, matched, limit_hist))
+        buckets = {'waiting_approval': [], 'approved': [], 'rejected': []}
+        for rid, state in request.env.cr.fetchall():
+            buckets[state].append(rid)
+        all_ids = buckets['waiting_approval'] + buckets['approved'] + buckets['rejected']
+        recs = Req.browse(all_ids)
+        return tuple(
+            Req.browse(buckets[state]).with_prefetch(recs._prefetch_ids)
+            for state in ('waiting_approval', 'approved', 'rejected')
+        )
+
+    def _request_display_map(self, reqs):
+        """Field tampilan request (req_disp_map) dari batch read request + timesheet asal."""
+        if not reqs:
+            return {}
+        Req = reqs.browse()
+        fnames = ['z_request_type', 'z_timesheet_id', 'z_current_start_date', 'z_current_end_date',
+                  'z_current_time_spent', 'z_name']
+        fnames += [f for f in ('z_reason_reject', 'z_reason_reject_description') if f in Req._fields]
+        rows = reqs.read(fnames, load=False)
+        ts_ids = list({r['z_timesheet_id'] for r in rows if r['z_timesheet_id']})
+        ts_dates = {
+            ts['id']: ts
+            for ts in request.env['account.analytic.line'].sudo().browse(ts_ids).read(
+                ['z_timesheet_start_date', 'z_timesheet_end_date'], load=False)
+        }
+        disp = {}
+        for r in rows:
+            ts = ts_dates.get(r['z_timesheet_id']) or {}
+            disp[r['id']] = {
+                'type': r['z_request_type'],
+                'ori_start': _to_wib(ts.get('z_timesheet_start_date') or False),
+                'ori_end': _to_wib(ts.get('z_timesheet_end_date') or False),
+                'new_start': _to_wib(r['z_current_start_date']),
+                'new_end': _to_wib(r['z_current_end_date']),
+                'hours': round(r['z_current_time_spent'] or 0.0, 2),
+                'desc': r['z_name'] or '',
+                'reject_reason': r.get('z_reason_reject') or '',
+                'reject_reason_desc': r.get('z_reason_reject_description') or '',
+            }
+        return disp
 
     def _compute_depth_map(self, tasks):
-        depth_map = {}
-        for t in tasks:
-            depth = 0
-            cur = t
-            while cur.parent_id:
-                depth += 1
-                cur = cur.parent_id
-            depth_map[t.id] = depth
-        return depth_map
-
-    def _order_parent_child(self, tasks, latest_first=False):
-        """Urutkan parent → child. Default: terlama (id asc) untuk parent & child."""
-        if not tasks:
-            return tasks
-        Task = request.env['project.task'].sudo()
-        ordered = Task.browse()
-        if latest_first:
-            parents = tasks.filtered(lambda t: not t.parent_id).sorted(key=lambda r: r.id, reverse=True)
-        else:
-            parents = tasks.filtered(lambda t: not t.parent_id).sorted(key=lambda r: r.id)  # id asc = terlama
-
-        def add_branch(p):
-            nonlocal ordered
-            ordered |= p
-            if latest_first:
-                children = tasks.filtered(lambda c: c.parent_id.id == p.id).sorted(key=lambda r: r.id, reverse=True)
-            else:
-                children = tasks.filtered(lambda c: c.parent_id.id == p.id).sorted(key=lambda r: r.id)  # id asc
-            for ch in children:
-                add_branch(ch)
-
-        for p in parents:
-            add_branch(p)
+        """{task_id: kedalaman absolut} (root = 0), dari parent_path yang dipelihara ORM."""
+        return {
+            row['id']: max((row['parent_path'] or '').count('/') - 1, 0)
+            for row in (tasks.read(['parent_path'], load=False) if tasks else [])
+        }
 
-        # Orphans (parent di luar set) ikut dimasukkan supaya tampil
-        if latest_first:
-            orphans = tasks.filtered(lambda t: t.parent_id and t.parent_id not in tasks).sorted(key=lambda r: r.id,
-                                                                                                reverse=True)
+    def _tree_order_sql(self, Task, domain, latest_first=False, group_field=None):
+        """Subquery (id, grp, sort_path) urutan parent → child untuk semua task di domain, dihitung di database.
+        Root dulu, lalu orphan (parent di luar set), masing-masing diikuti turunannya; default terlama (id asc).
+        Dengan group_field, pohon dibangun per grup (grp = nilai kolom apa adanya, parent harus di grup yang sama)."""
+        sign = -1 if latest_first else 1
+        if group_field:
+            if not self._tree_groupable(Task, group_field):
+                raise ValueError("Invalid tree group field: %s" % group_field)
+            grp = SQL.identifier(Task._table, group_field)
         else:
-            orphans = tasks.filtered(lambda t: t.parent_id and t.parent_id not in tasks).sorted(key=lambda r: r.id)
-        for o in orphans:
-            if o not in ordered:
-                add_branch(o)
-        return ordered
+            grp = SQL('NULL')
+        matched = Task._search(domain).select(
+            SQL.identifier(Task._table, 'id'),
+            SQL.identifier(Task._table, 'parent_id'),
+            grp,
+        )
+        return SQL("""
+            WITH RECURSIVE matched(id, parent_id, grp) AS (%(matched)s),
+            tree AS (
+                SELECT m.id, m.grp,
+                       ARRAY[CASE WHEN m.parent_id IS NULL THEN 0 ELSE 1 END, %(sign)s * m.id] AS sort_path
+                  FROM matched m
+                 WHERE m.parent_id IS NULL
+                    OR NOT EXISTS (
+                        SELECT 1 FROM matched p WHERE p.id = m.parent_id AND p.grp IS NOT DISTINCT FROM m.grp
+                    )
+                UNION ALL
+                SELECT c.id, c.grp, tree.sort_path || (%(sign)s * c.id)
+                  FROM matched c
+                  JOIN tree ON c.parent_id = tree.id AND c.grp IS NOT DISTINCT FROM tree.grp
+            )
+            SELECT id, grp, sort_path FROM tree
+        """, matched=matched, sign=sign)
+
+    def _tree_page(self, Task, domain, latest_first=False, offset=0, limit=None):
+        """Ambil hanya task untuk satu halaman, sudah dalam urutan parent → child."""
+        request.env.cr.execute(SQL(
+            "SELECT t.id FROM (%s) t ORDER BY t.sort_path LIMIT %s OFFSET %s",
+            self._tree_order_sql(Task, domain, latest_first=latest_first), limit, offset,
+        ))
+        return Task.browse([row[0] for row in request.env.cr.fetchall()])
+
+    def _tree_groupable(self, Task, group_field):
+        """Hanya kolom tersimpan many2one / selection yang bisa dipakai sebagai grup pohon."""
+        field = Task._fields.get(group_field)
+        return bool(field and field.store and field.type in ('many2one', 'selection'))
+
+    def _tree_group_slices(self, Task, domain, group_field, group_offsets, limit, latest_first=False):
+        """Satu query untuk potongan halaman semua grup sekaligus.
+        group_offsets: {nilai kolom (id many2one / key selection) atau None: offset}.
+        Return {grp: [task ids dalam urutan parent → child]}."""
+        if not group_offsets:
+            return {}
+        keys = list(group_offsets)
+        # nilai grup dibandingkan dengan tipe kolom aslinya (bukan cast text)
+        if Task._fields[group_field].type == 'many2one':
+            keys_array = SQL("%s::int[]", keys)
+        else:
+            keys_array = SQL("%s::varchar[]", keys)
+        request.env.cr.execute(SQL("""
+            SELECT r.grp, r.id
+              FROM (
+                    SELECT t.id, t.grp, row_number() OVER (PARTITION BY t.grp ORDER BY t.sort_path) - 1 AS pos
+                      FROM (%s) t
+                   ) r
+              JOIN unnest(%s, %s::int[]) AS w(grp, off)
+                ON r.grp IS NOT DISTINCT FROM w.grp AND r.pos >= w.off AND r.pos < w.off + %s
+          ORDER BY r.grp, r.pos
+        """, self._tree_order_sql(Task, domain, latest_first=latest_first, group_field=group_field),
+            keys_array, [group_offsets[k] for k in keys], limit))
+        result = {k: [] for k in keys}
+        for grp, tid in request.env.cr.fetchall():
+            result.setdefault(grp, []).append(tid)
+        return result
+
+    def _task_neighbours(self, Task, domain, task_id, order=None):
+        """Posisi task dalam listing (domain + order) dengan satu query window function.
+        Return (prev_id, next_id, posisi 1-based, total) atau None bila task tidak ada di listing."""
+        query = Task._search(domain, order=order)
+        window = SQL("(ORDER BY %s)", query.order)
+        query.order = None
+        table_id = SQL.identifier(Task._table, 'id')
+        matched = query.select(
+            SQL("%s AS id", table_id),
+            SQL("lag(%s) OVER %s AS prev_id", table_id, window),
+            SQL("lead(%s) OVER %s AS next_id", table_id, window),
+            SQL("row_number() OVER %s AS pos", window),
+            SQL("count(*) OVER () AS total"),
+        )
+        request.env.cr.execute(SQL(
+            "SELECT n.prev_id, n.next_id, n.pos, n.total FROM (%s) n WHERE n.id = %s",
+            matched, task_id,
+        ))
+        row = request.env.cr.fetchone()
+        if not row:
+            return None
+        prev_id, next_id, pos, total = row
+        return prev_id or False, next_id or False, pos, total
 
     def _get_running_task_ids(self, task_ids):
-        """Kembalikan set id task yang punya timesheet berjalan (end_date False)."""
+        """Kembalikan set id task yang punya timesheet berjalan (end_date False).
+        Cukup id task di halaman yang tampil; lookup memakai partial index account_analytic_line_z_open_timer_uniq."""
         try:
             if not task_ids:
                 return set()
             AAL = request.env['account.analytic.line'].sudo()
-            open_lines = AAL.search([
+            groups = AAL._read_group([
                 ('task_id', 'in', list(task_ids)),
                 ('z_timesheet_end_date', '=', False),
-            ])
-            return set(open_lines.mapped('task_id').ids)
+                ('z_timer_state', 'in', ('running', 'paused')),
+            ], groupby=['task_id'])
+            return {task.id for (task,) in groups if task}
         except Exception:
             return set()
 
+    def _build_task_rows(self, tasks):
+        """View-model baris list task: {task_id: dict} siap render.
+        Semua kolom dibaca dengan beberapa read batch, jumlah query tetap berapapun ukuran halaman."""
+        if not tasks:
+            return {}
+        env = request.env
+        query_count = env.cr.sql_log_count
+        Task = tasks.sudo()
+        rows = Task.read([
+            'name', 'z_display_master_task', 'project_id', 'partner_id', 'z_project_task_state',
+            'z_head_assignes_ids', 'z_member_assignes_ids', 'z_technology_id', 'z_severity_id',
+            'z_planned_start_date', 'z_planned_end_date', 'z_bobot_entry', 'z_progress_project',
+        ], load=False)
+
+        def _read_names(field_name, ids, name_field='name'):
+            ids = list({i for i in ids if i})
+            if not ids:
+                return {}
+            Model = env[Task._fields[field_name].comodel_name].sudo()
+            return {r['id']: r[name_field] or '' for r in Model.browse(ids).read([name_field])}
+
+        projects = {}
+        project_ids = list({r['project_id'] for r in rows if r['project_id']})
+        if project_ids:
+            for r in env['project.project'].sudo().browse(project_ids).read(['name', 'label_tasks']):
+                projects[r['id']] = r
+        partners = _read_names('partner_id', [r['partner_id'] for r in rows])
+        employees = _read_names('z_head_assignes_ids', [
+            e for r in rows for e in (r['z_head_assignes_ids'] + r['z_member_assignes_ids'])
+        ])
+        technologies = _read_names('z_technology_id', [r['z_technology_id'] for r in rows], 'z_name')
+        severities = _read_names('z_severity_id', [r['z_severity_id'] for r in rows], 'z_name')
+        state_labels = dict(Task._fields['z_project_task_state'].selection)
+
+        result = {}
+        for r in rows:
+            prj = projects.get(r['project_id']) or {}
+            result[r['id']] = {
+                'name': r['name'] or '',
+                'master_task': r['z_display_master_task'] or '',
+                'project_name': prj.get('name') or '',
+                'project_label': prj.get('label_tasks') or prj.get('name') or '',
+                'partner_name': partners.get(r['partner_id'], ''),
+                'state_label': state_labels.get(r['z_project_task_state']) or '',
+                'head_names': ', '.join(employees.get(e, '') for e in r['z_head_assignes_ids']),
+                'member_names': ', '.join(employees.get(e, '') for e in r['z_member_assignes_ids']),
+                'technology': technologies.get(r['z_technology_id'], ''),
+                'severity': severities.get(r['z_severity_id'], ''),
+                'planned_start': r['z_planned_start_date'] or '',
+                'planned_end': r['z_planned_end_date'] or '',
+                'bobot_entry': r['z_bobot_entry'] or 0.0,
+                'progress': r['z_progress_project'] or 0.0,
+            }
+        _logger.debug("Portal task rows: %s rows, %s queries", len(result), env.cr.sql_log_count - query_count)
+        return result
+
     # ---------------- AUX AFTER CREATE ----------------
     def _finalize_portal_task_after_create(self, task, forced_project_id=None):
         if not task:
@@ -392,7 +505,10 @@ class PortalProjectControllers(http.Controller):
             _logger.error("Finalize portal task error: %s", e)
 
     # ---------------- DOCUMENT HELPERS ----------------
-    def _create_document_from_attachment(self, attachment, task):
+    def _create_documents_from_attachments(self, attachments, task):
+        """Buat documents.document untuk semua attachment sekaligus (satu create batch)."""
+        if not attachments:
+            return
         try:
             Docs = request.env['documents.document'].sudo()
         except Exception:
@@ -404,7 +520,7 @@ class PortalProjectControllers(http.Controller):
             folder = request.env.ref('documents.documents_finance_folder', raise_if_not_found=False)
         except Exception:
             folder = None
-        vals = {
+        vals_list = [{
             'name': attachment.name,
             'attachment_id': attachment.id,
             'folder_id': folder and folder.id or False,
@@ -412,12 +528,36 @@ class PortalProjectControllers(http.Controller):
             'partner_id': task.partner_id.id if task.partner_id else False,
             'res_model': 'project.task',
             'res_id': task.id,
-        }
+        } for attachment in attachments]
         try:
-            Docs.create(vals)
+            Docs.create(vals_list)
         except Exception as e:
             _logger.error("Create document from attachment failed: %s", e)
 
+    def _store_uploaded_files(self, files, res_model, res_id):
+        """Simpan file upload secara streaming (lihat ir.attachment._create_from_upload_stream).
+        Batas per file & total per request dari System Parameters. Return (attachments, nama file yang ditolak)."""
+        Attachment = request.env['ir.attachment'].sudo()
+        max_bytes, max_total = Attachment._get_portal_upload_limits()
+        attachments = Attachment.browse()
+        skipped = []
+        used = 0
+        for f in files:
+            if not (f and f.filename):
+                continue
+            try:
+                att = Attachment._create_from_upload_stream(
+                    f.stream, f.filename, f.content_type, res_model, res_id,
+                    max_bytes=max(0, min(max_bytes, max_total - used)),
+                )
+            except Exception as ex:
+                _logger.error("Attachment upload error: %s", ex)
+                skipped.append(f.filename)
+                continue
+            used += att.file_size
+            attachments |= att
+        return attachments, skipped
+
     @http.route('/portal/project/<int:project_id>/info', type='http', auth='user', methods=['GET'])
     def portal_project_info(self, project_id):
         try:
@@ -451,6 +591,45 @@ class PortalProjectControllers(http.Controller):
         except Exception as e:
             return Response(json.dumps({'success': False, 'error': str(e)}), content_type='application/json')
 
+    # ---------------- AUTOCOMPLETE (TYPEAHEAD) ----------------
+    _autocomplete_models = {
+        'projects': 'project.project',
+        'tags': 'project.tags',
+    }
+
+    @http.route('/portal/autocomplete/<string:kind>', type='http', auth='user', methods=['GET'])
+    def portal_autocomplete(self, kind, q='', cursor=None, limit=20, **kw):
+        """Opsi picker (select2 ajax): filter name ilike (index trigram), keyset cursor pada id."""
+        try:
+            model = self._autocomplete_models.get(kind)
+            if not model:
+                return Response(json.dumps({'success': False, 'error': 'Unknown picker'}),
+                                content_type='application/json')
+            try:
+                limit = max(1, min(int(limit), 50))
+            except Exception:
+                limit = 20
+            domain = []
+            q = (q or '').strip()
+            if q:
+                domain.append(('name', 'ilike', q))
+            try:
+                cursor = int(cursor) if cursor else 0
+            except Exception:
+                cursor = 0
+            if cursor:
+                domain.append(('id', '>', cursor))
+            recs = request.env[model].sudo().search_read(domain, ['name'], order='id asc', limit=limit + 1)
+            has_more = len(recs) > limit
+            recs = recs[:limit]
+            return Response(json.dumps({
+                'success': True,
+                'results': [{'id': r['id'], 'text': r['name'] or ''} for r in recs],
+                'next_cursor': recs[-1]['id'] if has_more else False,
+            }), content_type='application/json')
+        except Exception as e:
+            return Response(json.dumps({'success': False, 'error': str(e)}), content_type='application/json')
+
     # ---------------- ROUTE ----------------
     @http.route([
         '/portal/tasks',
@@ -892,111 +1071,32 @@ class PortalProjectControllers(http.Controller):
             if not t:
                 return request.redirect('/portal/tasks?error=Task not found')
 
-            root_task = t
-            while root_task.parent_id:
-                root_task = root_task.parent_id
-
-            employee = request.env['hr.employee'].sudo().search([('user_id', '=', request.env.user.id)], limit=1)
+            root_task = Task.browse(int(t.parent_path.split('/')[0])) if t.parent_path else t
 
-            allow_for_others = (t.z_type_non_project == 'others')
+            portal_ctx = self._portal_ctx()
+            employee = portal_ctx.employee
 
-            if request.env.user.has_group('base.group_portal'):
-                if (flags['is_engineer'] or flags['is_delivery_support'] or flags['is_readonly_user']):
-                    if not allow_for_others:
-                        if (not employee) or (employee not in t.z_member_assignes_ids):
-                            return request.redirect('/portal/tasks?error=Not allowed')
-                if flags['is_head_engineer'] and not (flags['is_pm'] or flags['is_admin']):
-                    if not allow_for_others:
-                        if (not employee) or (employee not in (t.z_head_assignes_ids | t.z_member_assignes_ids)):
-                            return request.redirect('/portal/tasks?error=Not allowed')
+            if not self._can_open_task(t, flags, portal_ctx, allow_others=True):
+                return request.redirect('/portal/tasks?error=Not allowed')
 
             # Timer state
             active_start = ''
             active_running = False
             active_paused = False
             if employee:
-                open_line = request.env['account.analytic.line'].sudo().search([
-                    ('task_id', '=', t.id),
-                    ('employee_id', '=', employee.id),
-                    ('z_timesheet_end_date', '=', False)
-                ], order='id desc', limit=1)
-                if open_line and open_line.z_timesheet_start_date:
-                    active_start = fields.Datetime.to_string(open_line.z_timesheet_start_date)
+                timer_state = request.env['account.analytic.line'].sudo()._portal_timer_state(t, employee)
+                if timer_state['start_at']:
+                    active_start = timer_state['start_at']
                     active_running = True
-                    active_paused = bool(open_line.z_is_paused)
-
-            Req = request.env['account.analytic.line.request'].sudo()
-            limit_hist = 20
-            pending_reqs = Req.search([
-                '|', ('z_task_id', '=', t.id),
-                ('z_timesheet_id.task_id', '=', t.id),
-                ('z_state', '=', 'waiting_approval')
-            ])
-            approved_reqs = Req.search([
-                '|', ('z_task_id', '=', t.id),
-                ('z_timesheet_id.task_id', '=', t.id),
-                ('z_state', '=', 'approved')
-            ], order='id desc', limit=limit_hist)
-            rejected_reqs = Req.search([
-                '|', ('z_task_id', '=', t.id),
-                ('z_timesheet_id.task_id', '=', t.id),
-                ('z_state', '=', 'rejected')
-            ], order='id desc', limit=limit_hist)
-
-            pending_reqs = self._filter_requests_by_role(pending_reqs, t, flags, employee)
-            approved_reqs = self._filter_requests_by_role(approved_reqs, t, flags, employee)
-            rejected_reqs = self._filter_requests_by_role(rejected_reqs, t, flags, employee)
-
-            timesheets = t.timesheet_ids
-            if flags['restrict_timesheet_to_self'] and employee:
-                timesheets = timesheets.filtered(lambda l: l.employee_id.id == employee.id)
-
-            def _ts_sort_key(rec):
-                return rec.z_timesheet_start_date or rec.create_date or fields.Datetime.now()
-
-            timesheets = timesheets.sorted(key=_ts_sort_key, reverse=True)
-            ts_page_size = 5
-            timesheets_show = timesheets[:ts_page_size]
-            ts_pager = {
-                'page': 1,
-                'total_pages': (len(timesheets) + ts_page_size - 1) // ts_page_size if timesheets else 1,
-                'page_size': ts_page_size,
-                'total': len(timesheets),
-            }
-
-            timesheet_display_map = {}
-            for ts in timesheets_show:
-                timesheet_display_map[ts.id] = {
-                    'start_wib': _to_wib(ts.z_timesheet_start_date),
-                    'end_wib': _to_wib(ts.z_timesheet_end_date) if ts.z_timesheet_end_date else False,
-                }
-
-            # Update req_disp_map untuk include rejection reason:
-            req_disp_map = {}
-            for req in (pending_reqs | approved_reqs | rejected_reqs):
-                original_start = req.z_timesheet_id.z_timesheet_start_date if req.z_timesheet_id else False
-                original_end = req.z_timesheet_id.z_timesheet_end_date if req.z_timesheet_id else False
-                req_disp_map[req.id] = {
-                    'type': req.z_request_type,
-                    'ori_start': _to_wib(original_start),
-                    'ori_end': _to_wib(original_end),
-                    'new_start': _to_wib(req.z_current_start_date),
-                    'new_end': _to_wib(req.z_current_end_date),
-                    'hours': round(req.z_current_time_spent, 2),
-                    'desc': req.z_name or '',
-                    'reject_reason': getattr(req, 'z_reason_reject', '') or '',
-                    'reject_reason_desc': getattr(req, 'z_reason_reject_description', '') or '',
-                }
+                    active_paused = timer_state['paused']
 
-            invoice_plans = t.z_invoice_plan_ids.sorted(key=lambda r: (r.z_invoice_date or fields.Date.today(), r.id))
-            ip_page_size = 5
-            invoice_plans_show = invoice_plans[:ip_page_size]
-            ip_pager = {
-                'page': 1,
-                'total_pages': (len(invoice_plans) + ip_page_size - 1) // ip_page_size if invoice_plans else 1,
-                'page_size': ip_page_size,
-                'total': len(invoice_plans),
-            }
+            # tab berat (timesheets, requests, invoice plan, subtasks) dimuat lazy via /portal/task/<id>/tab/<tab>;
+            # halaman awal hanya butuh jumlah untuk badge tab
+            ts_pager = {'total': request.env['account.analytic.line'].sudo().search_count(
+                self._task_timesheet_domain(t, flags, employee))}
+            ip_pager = {'total': request.env['project.task.invoice.plan'].sudo().search_count(
+                [('z_invoce_plan_id', '=', t.id)])}
+            subtask_count = Task.search_count([('parent_id', '=', t.id)])
 
             can_full_edit = not (flags['is_delivery_support'] or flags['is_readonly_user'])
             is_leaf = not bool(t.child_ids)
@@ -1018,11 +1118,11 @@ class PortalProjectControllers(http.Controller):
             Master = request.env['task.master'].sudo()
 
             def _children_of(mrec):
-                return Master.search([('z_parent_id', '=', mrec.id)])
+                return Master._master_children(mrec.id)
 
             if not t.parent_id:
                 # Root task => tampilkan hanya master root
-                master_tasks_filtered = Master.search([('z_parent_id', '=', False)])
+                master_tasks_filtered = Master._master_roots()
             else:
                 parent_master = t.parent_id.z_master_task_id
                 if parent_master:
@@ -1037,7 +1137,7 @@ class PortalProjectControllers(http.Controller):
                         direct_children = _children_of(parent_master)
                         master_tasks_filtered = direct_children if direct_children else parent_master
                 else:
-                    master_tasks_filtered = Master.search([('z_parent_id', '=', False)])
+                    master_tasks_filtered = Master._master_roots()
 
             if t.z_master_task_id and t.z_master_task_id not in master_tasks_filtered:
                 master_tasks_filtered |= t.z_master_task_id
@@ -1056,9 +1156,8 @@ class PortalProjectControllers(http.Controller):
                 nav_domain.append(('parent_id', '=', t.parent_id.id if t.parent_id else False))
 
                 # Apply same restriction as list mode for portal users
-                if request.env.user.has_group('base.group_portal'):
-                    employee_nav = request.env['hr.employee'].sudo().search([('user_id', '=', request.env.user.id)],
-                                                                            limit=1)
+                if portal_ctx.is_portal:
+                    employee_nav = portal_ctx.employee
                     if employee_nav:
                         assignee_or = ['|',
                                        ('z_head_assignes_ids', 'in', [employee_nav.id]),
@@ -1074,53 +1173,20 @@ class PortalProjectControllers(http.Controller):
                     if must_restrict:
                         nav_domain = expression.AND([nav_domain, assignee_or])
 
-                siblings = Task.search(nav_domain, order='id asc')
-                sib_ids = [r.id for r in siblings]
-                if t.id in sib_ids:
-                    idx = sib_ids.index(t.id)
-                    nav_index = idx + 1
-                    nav_total = len(sib_ids)
-                    nav_prev_id = sib_ids[idx - 1] if idx > 0 else False
-                    nav_next_id = sib_ids[idx + 1] if idx < nav_total - 1 else False
+                nav = self._task_neighbours(Task, nav_domain, t.id, order='id asc')
+                if nav:
+                    nav_prev_id, nav_next_id, nav_index, nav_total = nav
             except Exception:
                 pass
 
-            cur_emp = request.env['hr.employee'].sudo().search([('user_id', '=', request.env.user.id)], limit=1)
-            is_mgr_for_others = False
-            if t.z_type_non_project == 'others' and cur_emp:
-                # cek hak approve untuk pending requests pada task ini
-                for rq in (pending_reqs | approved_reqs | rejected_reqs):
-                    emp = rq.z_employee_id or (rq.z_timesheet_id and rq.z_timesheet_id.employee_id)
-                    if emp and emp.parent_id and emp.parent_id.id == cur_emp.id:
-                        is_mgr_for_others = True
-                        break
-            t.sudo()._compute_actual_dates()
-            t.sudo()._compute_progress()
-            t.sudo()._getMandaysBudget()
-            t.sudo()._getMandaysBudgetEntry()
-            t.sudo()._getActualMandaysBudget()
-            t.sudo()._getSubtaskCount()
-            t.sudo()._getTimesheetCount()
-            t.sudo().onchange_bobot_entry()
-            t.sudo()._getProjectTeams()
-            t.sudo()._getQualityCalculation()
-            t.sudo().action_bobot_sync()
+            # nilai turunan dihitung saat input berubah (project.task._mark_portal_dirty); GET ini read-only
             values = {
                 'page_name': 'Edit Task',
                 'task': t,
                 'task_description': self._convert_html_to_text(t.description or ''),
-                'timesheets': timesheets,
-                'timesheets_show': timesheets_show,
                 'ts_pager': ts_pager,
-                'invoice_plans_show': invoice_plans_show,
                 'ip_pager': ip_pager,
-                'subtasks': request.env['project.task'].sudo().search([('parent_id', '=', t.id)]),
-
-                'pending_requests': pending_reqs,
-                'approved_requests': approved_reqs,
-                'rejected_requests': rejected_reqs,
-                'req_disp_map': req_disp_map,
-                'zeiten_map': timesheet_display_map,
+                'subtask_count': subtask_count,
 
                 'kw': kw_local,
 
@@ -1148,14 +1214,14 @@ class PortalProjectControllers(http.Controller):
                 'is_leaf': is_leaf,
                 'portal_task_form_readonly': portal_task_form_readonly,
                 'portal_task_form_readonly_all': portal_task_form_readonly_all,
-                'can_approve_timesheet_for_task': is_mgr_for_others,
 
                 'employees': employees_filtered,
                 'master_tasks': master_tasks_filtered,
                 'show_back_to_project_link': bool(flags.get('can_view_project_page')),
+                'portal_employee': employee,
 
                 **flags,
-                **{k: v for k, v in common.items() if k not in ('employees', 'master_tasks')},
+                **common,
             }
             return request.render('z_project.portal_task_page', values)
 
@@ -1177,10 +1243,10 @@ class PortalProjectControllers(http.Controller):
                     pm = Master.browse(parent_master_hint).exists()
 
                 if pm:
-                    children = Master.search([('z_parent_id', '=', pm.id)])
+                    children = Master._master_children(pm.id)
                     master_tasks_filtered = children if children else pm
                 else:
-                    master_tasks_filtered = Master.search([('z_parent_id', '=', False)])
+                    master_tasks_filtered = Master._master_roots()
                 parent_ctx = {
                     'parent_task': parent_task,
                     'project_id': parent_task.project_id.id if parent_task.project_id else False,
@@ -1193,7 +1259,7 @@ class PortalProjectControllers(http.Controller):
                     'proj_type': parent_task.project_id.z_type_in_project if parent_task.project_id else '',
                 }
             elif project:
-                master_tasks_filtered = Master.search([('z_parent_id', '=', False)])
+                master_tasks_filtered = Master._master_roots()
                 parent_ctx = {
                     'parent_task': False,
                     'project_id': project.id,
@@ -1204,7 +1270,7 @@ class PortalProjectControllers(http.Controller):
                     'proj_type': project.z_type_in_project or '',
                 }
             else:
-                master_tasks_filtered = Master.search([('z_parent_id', '=', False)])
+                master_tasks_filtered = Master._master_roots()
                 parent_ctx = {'parent_task': False, 'proj_type': ''}
 
             if parent_task and parent_task.project_id:
@@ -1238,8 +1304,9 @@ class PortalProjectControllers(http.Controller):
                 'employees': employees_filtered,
                 'master_tasks': master_tasks_filtered,
                 'show_back_to_project_link': bool(flags.get('can_view_project_page')),
+                'portal_employee': self._portal_ctx().employee,
                 **parent_ctx,
-                **{k: v for k, v in common.items() if k not in ('employees', 'master_tasks')},
+                **common,
                 **flags,
             }
             return request.render('z_project.portal_task_page', values)
@@ -1247,13 +1314,8 @@ class PortalProjectControllers(http.Controller):
         # LIST MODE
         domain = []
         if search:
-            domain += [
-                '|', '|', '|',
-                ('name', 'ilike', search),
-                ('project_id.name', 'ilike', search),
-                ('partner_id.name', 'ilike', search),
-                ('z_master_task_id.z_complete_name', 'ilike', search),
-            ]
+            # z_search_document = name + project + customer + master task (stored, index trigram)
+            domain.append(('z_search_document', 'ilike', search))
         if parent_id:
             domain.append(('parent_id', '=', parent_id))
         if project_id:
@@ -1276,8 +1338,9 @@ class PortalProjectControllers(http.Controller):
 
         base_domain = list(domain)
 
-        if request.env.user.has_group('base.group_portal'):
-            employee = request.env['hr.employee'].sudo().search([('user_id', '=', request.env.user.id)], limit=1)
+        portal_ctx = self._portal_ctx()
+        if portal_ctx.is_portal:
+            employee = portal_ctx.employee
             if employee:
                 assignee_or = ['|',
                                ('z_head_assignes_ids', 'in', [employee.id]),
@@ -1310,46 +1373,31 @@ class PortalProjectControllers(http.Controller):
 
         depth_map = {}
         running_task_ids = []
+        task_rows = {}
 
         project_root_counts = {}  # project_id -> jumlah root task
 
         if groupby:
-            if groupby not in Task._fields:
+            if groupby not in searchbar_groupings or not self._tree_groupable(Task, groupby):
                 groupby = ''
             else:
                 field = Task._fields[groupby]
                 read_groups = Task.read_group(domain, fields=[groupby], groupby=[groupby], orderby=groupby, lazy=False)
-                data_groups = []
-                all_ids_for_running = set()
+                latest_first = ('id desc' in order)
+
+                # 1) label, total & offset per grup dari hasil read_group (tanpa query tambahan)
+                group_meta = []
                 for idx, g in enumerate(read_groups):
                     key = g.get(groupby)
-                    g_domain = list(domain)
-                    label = 'Undefined'
-                    gid = False
                     if field.type == 'many2one':
                         gid = key and key[0] or False
-                        g_domain.append((groupby, '=', gid))
                         label = key and key[1] or 'Undefined'
                     else:
                         gid = key or False
-                        g_domain.append((groupby, '=', gid))
                         if field.type == 'selection':
                             label = dict(field.selection).get(key, 'Undefined')
                         else:
                             label = key or 'Undefined'
-                    all_recs = Task.search(g_domain, order=order)
-                    all_ids_for_running.update(all_recs.ids)
-                    all_recs = self._order_parent_child(all_recs, latest_first=('id desc' in order))
-                    dm = self._compute_depth_map(all_recs)
-                    depth_map.update(dm)
-
-                    root_count = None
-                    if groupby == 'project_id' and gid:
-                        try:
-                            root_count = Task.search_count([('project_id', '=', gid), ('parent_id', '=', False)])
-                            project_root_counts[gid] = root_count
-                        except Exception:
-                            root_count = None
 
                     page_param = f'group_page_{idx}'
                     try:
@@ -1358,35 +1406,64 @@ class PortalProjectControllers(http.Controller):
                         page_for_group = 1
                     if page_for_group < 1:
                         page_for_group = 1
-                    offset = (page_for_group - 1) * group_step
-                    slice_recs = all_recs[offset: offset + group_step]
-                    total_items = len(all_recs)
+                    group_meta.append({
+                        'idx': idx,
+                        'gid': gid,
+                        'grp': gid if gid is not False else None,
+                        'label': label,
+                        'total': g.get('__count', 0),
+                        'page': page_for_group,
+                        'page_param': page_param,
+                        'offset': (page_for_group - 1) * group_step,
+                    })
+
+                # 2) potongan halaman setiap grup (urutan parent → child) dalam satu query
+                slices = self._tree_group_slices(
+                    Task, domain, groupby, {m['grp']: m['offset'] for m in group_meta}, group_step,
+                    latest_first=latest_first,
+                )
+                visible_ids = [tid for m in group_meta for tid in slices.get(m['grp'], [])]
+                visible = Task.browse(visible_ids)
+
+                # 3) jumlah root task per project dalam satu read_group
+                if groupby == 'project_id':
+                    gids = [m['gid'] for m in group_meta if m['gid']]
+                    try:
+                        for rg in Task.read_group([('project_id', 'in', gids), ('parent_id', '=', False)],
+                                                  fields=['project_id'], groupby=['project_id'], lazy=False):
+                            if rg.get('project_id'):
+                                project_root_counts[rg['project_id'][0]] = rg.get('__count', 0)
+                        for gid in gids:
+                            project_root_counts.setdefault(gid, 0)
+                    except Exception:
+                        project_root_counts = {}
+
+                data_groups = []
+                for m in group_meta:
+                    total_items = m['total']
                     total_pages = (total_items + group_step - 1) // group_step
-                    pages = list(range(1, total_pages + 1))
+                    root_count = project_root_counts.get(m['gid']) if (groupby == 'project_id' and m['gid']) else None
                     data_groups.append({
-                        'group_index': idx,
-                        'group_value': label,
-                        'tasks': slice_recs,
+                        'group_index': m['idx'],
+                        'group_value': m['label'],
+                        'tasks': Task.browse(slices.get(m['grp'], [])).with_prefetch(visible._prefetch_ids),
                         'root_count': root_count,
                         'pager': {
-                            'page_param': page_param,
-                            'page': page_for_group,
+                            'page_param': m['page_param'],
+                            'page': m['page'],
                             'step': group_step,
-                            'offset': offset,
+                            'offset': m['offset'],
                             'total': total_items,
-                            'pages': pages,
+                            'pages': list(range(1, total_pages + 1)),
                         }
                     })
-                running_task_ids = list(self._get_running_task_ids(all_ids_for_running))
+                depth_map = self._compute_depth_map(visible)
+                running_task_ids = list(self._get_running_task_ids(set(visible_ids)))
+                task_rows = self._build_task_rows(visible)
                 tasks = data_groups
 
         if not groupby:
-            all_for_order = Task.search(domain, order=order)
-            depth_map = self._compute_depth_map(all_for_order)
-            running_task_ids = list(self._get_running_task_ids(set(all_for_order.ids)))
-
-            all_for_order = self._order_parent_child(all_for_order, latest_first=('id desc' in order))
-            total = len(all_for_order)
+            total = Task.search_count(domain)
             pager_header = pager(
                 url='/portal/tasks',
                 total=total,
@@ -1395,7 +1472,11 @@ class PortalProjectControllers(http.Controller):
                 url_args={'search': search, 'sortby': sortby, 'groupby': groupby,
                           'parent_id': parent_id, 'project_id': project_id}
             )
-            tasks = all_for_order[pager_header['offset']: pager_header['offset'] + step]
+            tasks = self._tree_page(Task, domain, latest_first=('id desc' in order),
+                                    offset=pager_header['offset'], limit=step)
+            depth_map = self._compute_depth_map(tasks)
+            running_task_ids = list(self._get_running_task_ids(set(tasks.ids)))
+            task_rows = self._build_task_rows(tasks)
 
             if project_id:
                 try:
@@ -1439,6 +1520,7 @@ class PortalProjectControllers(http.Controller):
             'common_query': common_query,
             'depth_map': depth_map,
             'running_task_ids': running_task_ids,
+            'task_rows': task_rows,
 
             'project_root_counts': project_root_counts,
 
@@ -1446,24 +1528,190 @@ class PortalProjectControllers(http.Controller):
             'is_leaf': False,
 
             'show_back_to_project_link': bool(flags.get('can_view_project_page')),
+            'portal_employee': portal_ctx.employee,
 
             **flags,
             **common,
         }
         return request.render('z_project.portal_task_page', values)
 
+    # ---------------- LAZY TABS (EDIT VIEW) ----------------
+    _lazy_tab_templates = {
+        'timesheets': 'z_project.portal_task_tab_timesheets',
+        'others_timesheets': 'z_project.portal_timesheet_embed',
+        'subtasks': 'z_project.portal_task_tab_subtasks',
+        'invoice_plan': 'z_project.portal_task_tab_invoice_plan',
+    }
+
+    def _can_open_task(self, task, flags, portal_ctx, allow_others=False):
+        """Restriksi akses task per role untuk user portal (fragment tab, batch feed, JSON).
+        allow_others=True hanya untuk halaman edit: task non-project 'others' boleh dibuka semua role,
+        datanya tetap diambil lewat endpoint yang memeriksa role."""
+        if not portal_ctx.is_portal or (allow_others and task.z_type_non_project == 'others'):
+            return True
+        employee = portal_ctx.employee
+        if flags['is_engineer'] or flags['is_delivery_support'] or flags['is_readonly_user']:
+            if (not employee) or (employee not in task.z_member_assignes_ids):
+                return False
+        if flags['is_head_engineer'] and not (flags['is_pm'] or flags['is_admin']):
+            if (not employee) or (employee not in (task.z_head_assignes_ids | task.z_member_assignes_ids)):
+                return False
+        return True
+
+    def _task_tab_allowed(self, task, tab, flags):
+        """Visibilitas tab edit view per role (sama dengan kondisi t-if tab di portal_task_page)."""
+        if tab == 'subtasks':
+            return bool(flags['is_pm'] or flags['is_head_engineer'])
+        if tab == 'invoice_plan':
+            return bool(flags['show_tab_invoice_plan']
+                        and (flags['is_pm'] or flags['is_head_engineer'] or flags['is_support'])
+                        and not flags['is_engineer'])
+        if tab == 'others_timesheets':
+            return task.z_type_non_project == 'others'
+        return True
+
+    def _task_timesheet_domain(self, task, flags, employee):
+        domain = [('task_id', '=', task.id)]
+        if flags['restrict_timesheet_to_self'] and employee:
+            domain.append(('employee_id', '=', employee.id))
+        return domain
+
+    def _task_tab_values(self, t, tab, flags, portal_ctx):
+        employee = portal_ctx.employee
+        values = {'task': t, **flags}
+
+        if tab in ('timesheets', 'others_timesheets'):
+            AAL = request.env['account.analytic.line'].sudo()
+            ts_owner = employee if (flags['restrict_timesheet_to_self'] and employee) else None
+            ts_page_size = 5
+            timesheets_show, ts_next_cursor = AAL._portal_timesheet_feed(t, employee=ts_owner, limit=ts_page_size)
+            pending_reqs, approved_reqs, rejected_reqs = self._request_history(t, flags, employee)
+
+            is_mgr_for_others = False
+            if t.z_type_non_project == 'others' and employee:
+                # cek hak approve untuk pending requests pada task ini
+                for rq in (pending_reqs | approved_reqs | rejected_reqs):
+                    emp = rq.z_employee_id or (rq.z_timesheet_id and rq.z_timesheet_id.employee_id)
+                    if portal_ctx.is_manager_of(emp):
+                        is_mgr_for_others = True
+                        break
+
+            values.update({
+                'timesheets': timesheets_show,
+                'timesheets_show': timesheets_show,
+                'ts_pager': {
+                    'page_size': ts_page_size,
+                    'total': AAL.search_count(self._task_timesheet_domain(t, flags, employee)),
+                    'has_more': bool(ts_next_cursor),
+                    'next_cursor': ts_next_cursor or '',
+                },
+                'zeiten_map': {
+                    ts.id: {
+                        'start_wib': _to_wib(ts.z_timesheet_start_date),
+                        'end_wib': _to_wib(ts.z_timesheet_end_date) if ts.z_timesheet_end_date else False,
+                    }
+                    for ts in timesheets_show
+                },
+                'pending_requests': pending_reqs,
+                'approved_requests': approved_reqs,
+                'rejected_requests': rejected_reqs,
+                'req_disp_map': self._request_display_map(pending_reqs | approved_reqs | rejected_reqs),
+                'can_approve_timesheet_for_task': is_mgr_for_others,
+            })
+        elif tab == 'subtasks':
+            values['subtasks'] = request.env['project.task'].sudo().search([('parent_id', '=', t.id)])
+        elif tab == 'invoice_plan':
+            invoice_plans = t.z_invoice_plan_ids.sorted(key=lambda r: (r.z_invoice_date or fields.Date.today(), r.id))
+            ip_page_size = self._invoice_plan_page_size
+            values.update({
+                'invoice_plans_show': invoice_plans[:ip_page_size],
+                'ip_pager': {
+                    'page': 1,
+                    'total_pages': (len(invoice_plans) + ip_page_size - 1) // ip_page_size if invoice_plans else 1,
+                    'page_size': ip_page_size,
+                    'total': len(invoice_plans),
+                },
+            })
+        return values
+
+    @http.route('/portal/task/<int:task_id>/tab/<string:tab>', type='http', auth='user', website=True, methods=['GET'])
+    def portal_task_tab(self, task_id, tab, **kw):
+        """Fragment HTML satu tab edit view, dimuat saat tab dibuka."""
+        template = self._lazy_tab_templates.get(tab)
+        if not template:
+            return request.not_found()
+        t = request.env['project.task'].sudo().browse(task_id).exists()
+        if not t:
+            return request.not_found()
+        flags = self._role_flags()
+        portal_ctx = self._portal_ctx()
+        if not self._can_open_task(t, flags, portal_ctx) or not self._task_tab_allowed(t, tab, flags):
+            return Response('Not allowed', status=403)
+        html = request.env['ir.qweb']._render(template, self._task_tab_values(t, tab, flags, portal_ctx))
+        return Response(html, content_type='text/html; charset=utf-8')
+
     # ---------------- JSON TIMESHEETS / INVOICE / TIMER / SUBTASK / INVOICE PLAN ROUTES ----------------
+    def _timesheet_feed_payload(self, task, lines, next_cursor, flags):
+        """Feed timesheet ringkas: baris data + satu blok permission untuk tabel & kartu."""
+        can_edit = task.z_project_task_state not in ('approved1', 'approved2', 'done')
+        # akses field (bukan read) agar prefetch dipakai bersama saat dipanggil per task dari feed batch
+        items = []
+        for ts in lines:
+            items.append({
+                'id': ts.id,
+                'start': fields.Datetime.to_string(ts.z_timesheet_start_date) if ts.z_timesheet_start_date else '',
+                'end': fields.Datetime.to_string(ts.z_timesheet_end_date) if ts.z_timesheet_end_date else '',
+                'employee': ts.employee_id.name or '',
+                'desc': ts.name or '',
+                'hours': round(ts.unit_amount or 0.0, 2),
+                'state': ts.z_state or '',
+            })
+        return {
+            'success': True,
+            'task_id': task.id,
+            'has_more': bool(next_cursor),
+            'next_cursor': next_cursor or '',
+            'permissions': {
+                'can_edit': can_edit,
+                'can_delete': can_edit and bool(flags['can_delete_timesheet']),
+            },
+            'items': items,
+        }
+
+    def _invoice_plan_feed_payload(self, task, plans, page, total_pages, flags):
+        """Feed invoice plan ringkas: baris data + satu blok permission untuk tabel & kartu."""
+        items = []
+        for inv in plans:
+            items.append({
+                'id': inv.id,
+                'number': inv.z_number_of_invoice or '',
+                'name': inv.z_name or '',
+                'date': inv.z_invoice_date.strftime('%d/%m/%Y') if inv.z_invoice_date else '',
+                'amount': inv.z_amount_total or 0.0,
+                'state': inv.z_state or '',
+            })
+        return {
+            'success': True,
+            'task_id': task.id,
+            'page': page,
+            'total_pages': total_pages,
+            'has_more': page < total_pages,
+            'permissions': {'can_edit': bool(flags['can_edit_invoice_plan'])},
+            'items': items,
+        }
+
     @http.route('/portal/task/<int:task_id>/timesheets/json', type='http', auth='user', methods=['GET'])
-    def portal_timesheets_json(self, task_id, page=1, **kw):
+    def portal_timesheets_json(self, task_id, **kw):
         try:
             task = request.env['project.task'].sudo().browse(task_id).exists()
             if not task:
                 return Response(json.dumps({'success': False, 'error': 'Task not found'}),
                                 content_type='application/json')
-            flags = self._role_flags()
-            employee = request.env['hr.employee'].sudo().search([('user_id', '=', request.env.user.id)], limit=1)
+            portal_ctx = self._portal_ctx()
+            flags = portal_ctx.flags
+            employee = portal_ctx.employee
 
-            if request.env.user.has_group('base.group_portal'):
+            if portal_ctx.is_portal:
                 if (flags['is_engineer'] or flags['is_delivery_support'] or flags['is_readonly_user']) and (
                         not employee or employee not in task.z_member_assignes_ids):
                     return Response(json.dumps({'success': False, 'error': 'Not allowed'}),
@@ -1473,28 +1721,15 @@ class PortalProjectControllers(http.Controller):
                     return Response(json.dumps({'success': False, 'error': 'Not allowed'}),
                                     content_type='application/json')
 
-            timesheets = task.timesheet_ids
-            if flags['restrict_timesheet_to_self'] and employee:
-                timesheets = timesheets.filtered(lambda l: l.employee_id.id == employee.id)
-
-            def _ts_sort_key(rec):
-                return rec.z_timesheet_start_date or rec.create_date or fields.Datetime.now()
-
-            timesheets = timesheets.sorted(key=_ts_sort_key, reverse=True)
-
-            try:
-                page = int(page)
-            except:
-                page = 1
-            if page < 1:
-                page = 1
+            ts_owner = employee if (flags['restrict_timesheet_to_self'] and employee) else None
             page_size = 5
-            total = len(timesheets)
-            total_pages = (total + page_size - 1) // page_size if total else 1
-            if page > total_pages:
-                page = total_pages
-            offset = (page - 1) * page_size
-            subset = timesheets[offset: offset + page_size]
+            subset, next_cursor = request.env['account.analytic.line'].sudo()._portal_timesheet_feed(
+                task, employee=ts_owner, cursor=kw.get('cursor'), limit=page_size)
+
+            # default: data terstruktur (dirender di browser); format=html untuk respons HTML lama
+            if kw.get('format') != 'html':
+                return Response(json.dumps(self._timesheet_feed_payload(task, subset, next_cursor, flags)),
+                                content_type='application/json')
 
             def _fmt_duration(hours_float):
                 total_minutes = int(round((hours_float or 0) * 60))
@@ -1588,12 +1823,10 @@ class PortalProjectControllers(http.Controller):
                     </div>
                 """)
 
-            has_more = page < total_pages
             return Response(json.dumps({
                 'success': True,
-                'page': page,
-                'total_pages': total_pages,
-                'has_more': has_more,
+                'has_more': bool(next_cursor),
+                'next_cursor': next_cursor or '',
                 'items_html': "".join(row_html_list),
                 'cards_html': "".join(card_list),
             }), content_type='application/json')
@@ -1601,6 +1834,102 @@ class PortalProjectControllers(http.Controller):
             _logger.error("Timesheets JSON error: %s", e)
             return Response(json.dumps({'success': False, 'error': str(e)}), content_type='application/json')
 
+    # ---------------- BATCH FEEDS (DASHBOARD) ----------------
+    _batch_feed_max_tasks = 100
+
+    # ukuran halaman invoice plan (tab, /invoice-plans/json & feed batch)
+    _invoice_plan_page_size = 5
+
+    def _invoice_plan_pages(self, tasks, limit):
+        """Halaman pertama invoice plan untuk banyak task dalam satu query.
+        Urutan sama dengan feed per task (tanggal invoice, kosong = hari ini, lalu id).
+        Return {task_id: (plans, total)}."""
+        Plan = request.env['project.task.invoice.plan'].sudo()
+        matched = Plan._search([('z_invoce_plan_id', 'in', tasks.ids)]).select(
+            SQL.identifier(Plan._table, 'id'),
+            SQL.identifier(Plan._table, 'z_invoce_plan_id'),
+            SQL.identifier(Plan._table, 'z_invoice_date'),
+        )
+        request.env.cr.execute(SQL("""
+            SELECT r.task_id, r.id, r.total
+              FROM (
+                    SELECT m.id, m.task_id,
+                           row_number() OVER w AS rn,
+                           count(*) OVER (PARTITION BY m.task_id) AS total
+                      FROM (%s) m(id, task_id, inv_date)
+                    WINDOW w AS (PARTITION BY m.task_id ORDER BY COALESCE(m.inv_date, CURRENT_DATE), m.id)
+                   ) r
+             WHERE r.rn <= %s
+          ORDER BY r.task_id, r.rn
+        """, matched, limit))
+        ids_by_task = defaultdict(list)
+        totals = {}
+        for task_id, plan_id, total in request.env.cr.fetchall():
+            ids_by_task[task_id].append(plan_id)
+            totals[task_id] = total
+        all_plans = Plan.browse([pid for ids in ids_by_task.values() for pid in ids])
+        return {
+            tid: (Plan.browse(ids).with_prefetch(all_plans._prefetch_ids), totals[tid])
+            for tid, ids in ids_by_task.items()
+        }
+
+    @http.route('/portal/tasks/feeds', type='http', auth='user', methods=['GET'])
+    def portal_tasks_feeds(self, task_ids='', include='timesheets,invoice_plans', limit=5, **kw):
+        """Feed timesheet & invoice plan banyak task sekaligus (dashboard).
+        task_ids: "1,2,3"; include: timesheets dan/atau invoice_plans; limit: baris timesheet per task (maks 20).
+        Invoice plan selalu halaman 1 dengan ukuran halaman /invoice-plans/json, agar page=2 dst. bisa dilanjutkan di sana.
+        Payload per task sama dengan /timesheets/json & /invoice-plans/json (mode terstruktur)."""
+        try:
+            try:
+                ids = [int(x) for x in (task_ids or '').split(',') if x.strip()]
+                limit = max(1, min(int(limit), 20))
+            except ValueError:
+                return Response(json.dumps({'success': False, 'error': 'Invalid parameters'}),
+                                content_type='application/json')
+            ids = list(dict.fromkeys(ids))[:self._batch_feed_max_tasks]
+            parts = {p.strip() for p in (include or '').split(',')}
+
+            # permission dievaluasi sekali untuk seluruh batch
+            portal_ctx = self._portal_ctx()
+            flags = portal_ctx.flags
+            employee = portal_ctx.employee
+            tasks = request.env['project.task'].sudo().browse(ids).exists()
+            allowed = tasks.filtered(lambda t: self._can_open_task(t, flags, portal_ctx))
+
+            result = {}
+            for tid in ids:
+                if tid not in allowed.ids:
+                    result[str(tid)] = {'success': False, 'error': 'Not allowed' if tid in tasks.ids else 'Task not found'}
+                else:
+                    result[str(tid)] = {'success': True}
+
+            if 'timesheets' in parts and allowed:
+                ts_owner = employee if (flags['restrict_timesheet_to_self'] and employee) else None
+                feeds = request.env['account.analytic.line'].sudo()._portal_timesheet_feed_batch(
+                    allowed, employee=ts_owner, limit=limit)
+                for t in allowed:
+                    lines, next_cursor = feeds.get(t.id, (request.env['account.analytic.line'], False))
+                    result[str(t.id)]['timesheets'] = self._timesheet_feed_payload(t, lines, next_cursor, flags)
+
+            if 'invoice_plans' in parts and allowed:
+                if flags['show_tab_invoice_plan']:
+                    page_size = self._invoice_plan_page_size
+                    pages = self._invoice_plan_pages(allowed, page_size)
+                    Plan = request.env['project.task.invoice.plan']
+                    for t in allowed:
+                        plans, total = pages.get(t.id, (Plan, 0))
+                        total_pages = (total + page_size - 1) // page_size if total else 1
+                        result[str(t.id)]['invoice_plans'] = self._invoice_plan_feed_payload(
+                            t, plans, 1, total_pages, flags)
+                else:
+                    for t in allowed:
+                        result[str(t.id)]['invoice_plans'] = {'success': False, 'error': 'Not allowed'}
+
+            return Response(json.dumps({'success': True, 'tasks': result}), content_type='application/json')
+        except Exception as e:
+            _logger.error("Batch feeds error: %s", e)
+            return Response(json.dumps({'success': False, 'error': str(e)}), content_type='application/json')
+
     # ---------------- JSON INVOICE PLANS ----------------
     @http.route('/portal/task/<int:task_id>/invoice-plans/json', type='http', auth='user', methods=['GET'])
     def portal_invoice_plans_json(self, task_id, page=1, **kw):
@@ -1622,7 +1951,7 @@ class PortalProjectControllers(http.Controller):
                 page = 1
             if page < 1:
                 page = 1
-            page_size = 5
+            page_size = self._invoice_plan_page_size
             total = len(invoice_plans)
             total_pages = (total + page_size - 1) // page_size if total else 1
             if page > total_pages:
@@ -1630,6 +1959,11 @@ class PortalProjectControllers(http.Controller):
             offset = (page - 1) * page_size
             subset = invoice_plans[offset: offset + page_size]
 
+            # default: data terstruktur (dirender di browser); format=html untuk respons HTML lama
+            if kw.get('format') != 'html':
+                return Response(json.dumps(self._invoice_plan_feed_payload(task, subset, page, total_pages, flags)),
+                                content_type='application/json')
+
             rows = []
             cards = []
             for inv in subset:
@@ -1716,6 +2050,20 @@ class PortalProjectControllers(http.Controller):
             return Response(json.dumps({'success': False, 'error': str(e)}), content_type='application/json')
 
     # ---------------- TIMER / TIMESHEET APIs ----------------
+    @http.route('/portal/task/<int:task_id>/timer/state', type='http', auth='user', methods=['GET'])
+    def portal_task_timer_state(self, task_id, **kw):
+        """State timer ringan untuk sinkronisasi tab (tanpa render ulang edit view)."""
+        try:
+            task = request.env['project.task'].sudo().browse(task_id).exists()
+            employee = self._portal_ctx().employee
+            if not task or not employee:
+                return Response(json.dumps({'success': False, 'error': 'Task or employee not found'}),
+                                content_type='application/json')
+            state = request.env['account.analytic.line'].sudo()._portal_timer_state(task, employee)
+            return Response(json.dumps(dict(state, success=True)), content_type='application/json')
+        except Exception as e:
+            return Response(json.dumps({'success': False, 'error': str(e)}), content_type='application/json')
+
     @http.route('/portal/task/<int:task_id>/timer', type='http', auth='user', website=True, methods=['POST'])
     def portal_task_timer(self, task_id, **post):
         try:
@@ -1723,23 +2071,36 @@ class PortalProjectControllers(http.Controller):
             if not task:
                 return Response(json.dumps({'success': False, 'error': 'Task not found'}),
                                 content_type='application/json')
-            employee = request.env['hr.employee'].sudo().search([('user_id', '=', request.env.user.id)], limit=1)
+            employee = self._portal_ctx().employee
             if not employee:
                 return Response(json.dumps({'success': False, 'error': 'Employee not found'}),
                                 content_type='application/json')
             action = post.get('action')
             AAL = request.env['account.analytic.line'].sudo()
+            # request_key dari client membuat klik ulang idempoten: key diklaim dulu (INSERT ... ON CONFLICT),
+            # key yang sudah selesai diproses mengembalikan respons tersimpan
+            TimerRequest = request.env['z.portal.timer.request'].sudo()
+            request_key = (post.get('request_key') or '').strip()[:64]
+            if request_key and not TimerRequest._claim_key(request_key, request.env.user, task, action):
+                replay = TimerRequest._get_response(request_key, request.env.user)
+                if replay is not None:
+                    return Response(replay, content_type='application/json')
+            # aksi timer per (task, employee) diserialisasi
+            AAL._portal_timer_lock(task, employee)
+
+            def _reply(payload):
+                data = json.dumps(payload)
+                if request_key:
+                    TimerRequest._store_response(request_key, request.env.user, data)
+                if payload.get('success'):
+                    AAL._portal_notify_timer(task, employee, payload.get('action') or action)
+                return Response(data, content_type='application/json')
 
             if action == 'start' and not task.z_member_assignes_ids:
-                return Response(json.dumps({'success': False, 'error': 'Tidak bisa start: belum ada member assignee'}),
-                                content_type='application/json')
+                return _reply({'success': False, 'error': 'Tidak bisa start: belum ada member assignee'})
 
             def _open():
-                return AAL.search([
-                    ('task_id', '=', task.id),
-                    ('employee_id', '=', employee.id),
-                    ('z_timesheet_end_date', '=', False)
-                ], order='id desc', limit=1)
+                return AAL._portal_open_timer(task, employee)
 
             if action == 'start':
                 line = _open()
@@ -1748,68 +2109,53 @@ class PortalProjectControllers(http.Controller):
                     # Pastikan status minimal in_progress ketika timer berjalan
                     if task.z_project_task_state == 'new':
                         task.write({'z_project_task_state': 'in_progress'})
-                    return Response(json.dumps(
+                    return _reply(
                         {'success': True, 'start_at': fields.Datetime.to_string(line.z_timesheet_start_date),
-                         'action': 'already_running'}), content_type='application/json')
-
-                line = AAL.create({
-                    'task_id': task.id,
-                    'project_id': task.project_id.id if task.project_id else False,
-                    'employee_id': employee.id,
-                    'name': f'Timer started for {task.name}',
-                    'z_timesheet_start_date': now,
-                    'date': now.date(),
-                    'z_is_paused': False,
-                    'z_pause_started_at': False,
-                    'z_pause_accum_seconds': 0,
-                    'z_timer_state': 'running',
-                    'z_state': 'draft',
-                })
+                         'action': 'already_running'})
+
+                try:
+                    # partial unique index account_analytic_line_z_open_timer_uniq: satu timer terbuka per (task, employee)
+                    with request.env.cr.savepoint():
+                        line = AAL.create({
+                            'task_id': task.id,
+                            'project_id': task.project_id.id if task.project_id else False,
+                            'employee_id': employee.id,
+                            'name': f'Timer started for {task.name}',
+                            'z_timesheet_start_date': now,
+                            'date': now.date(),
+                            'z_is_paused': False,
+                            'z_pause_started_at': False,
+                            'z_pause_accum_seconds': 0,
+                            'z_timer_state': 'running',
+                            'z_state': 'draft',
+                        })
+                except psycopg2.IntegrityError:
+                    # timer dibuat request lain yang commit setelah snapshot transaksi ini (REPEATABLE READ):
+                    # minta Odoo mengulang request dengan snapshot baru, yang akan melihat timer tersebut
+                    raise psycopg2.errors.SerializationFailure("Concurrent portal timer start")
                 # Ubah status ke in_progress saat timer start
                 if task.z_project_task_state == 'new':
                     task.write({'z_project_task_state': 'in_progress'})
-                return Response(json.dumps(
+                return _reply(
                     {'success': True, 'start_at': fields.Datetime.to_string(now), 'action': 'started',
-                     'timesheet_id': line.id}), content_type='application/json')
+                     'timesheet_id': line.id})
 
+            # pause / resume / stop: satu UPDATE bersyarat per transisi (lihat AAL._portal_timer_*)
             elif action == 'pause':
-                line = _open()
-                if not line:
-                    return Response(json.dumps({'success': False, 'error': 'No running timer'}),
-                                    content_type='application/json')
-                if line.z_is_paused:
-                    return Response(json.dumps({'success': True, 'action': 'paused'}), content_type='application/json')
-                if hasattr(line, 'action_pause_timer'):
-                    line.action_pause_timer()
-                else:
-                    line.write({'z_is_paused': True, 'z_pause_started_at': fields.Datetime.now()})
-                return Response(json.dumps({'success': True, 'action': 'paused'}), content_type='application/json')
+                if not AAL._portal_timer_pause(task, employee) and not _open():
+                    return _reply({'success': False, 'error': 'No running timer'})
+                return _reply({'success': True, 'action': 'paused'})
 
             elif action == 'resume':
-                line = _open()
+                line = AAL._portal_timer_resume(task, employee)[:1]
                 if not line:
-                    return Response(json.dumps({'success': False, 'error': 'No paused timer'}),
-                                    content_type='application/json')
-                if not line.z_is_paused:
-                    return Response(json.dumps({'success': True, 'action': 'running',
-                                                'start_at': fields.Datetime.to_string(line.z_timesheet_start_date)}),
-                                    content_type='application/json')
-                if hasattr(line, 'action_resume_timer'):
-                    line.action_resume_timer()
-                else:
-                    pause_started = line.z_pause_started_at
-                    accum = line.z_pause_accum_seconds or 0
-                    if pause_started:
-                        delta = (fields.Datetime.now() - pause_started).total_seconds()
-                        accum += max(0, int(delta))
-                    line.write({
-                        'z_is_paused': False,
-                        'z_pause_started_at': False,
-                        'z_pause_accum_seconds': accum
-                    })
-                return Response(json.dumps({'success': True, 'action': 'resumed',
-                                            'start_at': fields.Datetime.to_string(line.z_timesheet_start_date)}),
-                                content_type='application/json')
+                    line = _open()
+                    if not line:
+                        return _reply({'success': False, 'error': 'No paused timer'})
+                    return _reply({'success': True, 'action': 'running',
+                                   'start_at': fields.Datetime.to_string(line.z_timesheet_start_date)})
+                return _reply({'success': True, 'action': 'resumed',
+                               'start_at': fields.Datetime.to_string(line.z_timesheet_start_date)})
 
 
             elif action == 'stop':
@@ -1817,84 +2163,33 @@ class PortalProjectControllers(http.Controller):
                 desc = (post.get('description') or '').strip()
 
                 if not desc:
-                    return Response(json.dumps({'success': False, 'error': 'Description required'}),
+                    return _reply({'success': False, 'error': 'Description required'})
 
-                                    content_type='application/json')
-
-                line = _open()
+                # compute unit_amount terpicu dari end date (modified setelah UPDATE)
+                line = AAL._portal_timer_stop(task, employee, desc)[:1]
 
                 if not line:
-                    return Response(json.dumps({'success': False, 'error': 'No running timer'}),
-
-                                    content_type='application/json')
-
-                if line.z_is_paused and hasattr(line, 'action_resume_timer'):
-                    line.action_resume_timer()
-
-                end_time = fields.Datetime.now()
-
-                # TIDAK perlu hitung manual; compute unit_amount akan terpicu oleh write start/end
-
-                line.write({
-
-                    'z_timesheet_end_date': end_time,
-
-                    'name': desc,
-
-                    'z_timer_state': 'stopped',
-
-                    'z_state': 'approved',
-
-                })
-
-                attachment_ids = []
+                    return _reply({'success': False, 'error': 'No running timer'})
 
+                attachments = request.env['ir.attachment']
+                skipped = []
                 if hasattr(request, 'httprequest') and request.httprequest.files:
+                    attachments, skipped = self._store_uploaded_files(
+                        request.httprequest.files.getlist('attachments'), 'account.analytic.line', line.id)
+                    self._create_documents_from_attachments(attachments, task)
 
-                    for f in request.httprequest.files.getlist('attachments'):
-
-                        if f and f.filename:
-
-                            try:
-
-                                content = f.read()
-
-                                att = request.env['ir.attachment'].sudo().create({
-
-                                    'name': f.filename,
-
-                                    'type': 'binary',
-
-                                    'datas': base64.b64encode(content),
-
-                                    'res_model': 'account.analytic.line',
-
-                                    'res_id': line.id,
+                if attachments:
+                    line.message_post(body=f"Timer stopped with {len(attachments)} attachment(s).",
 
-                                    'mimetype': f.content_type or 'application/octet-stream',
+                                      attachment_ids=attachments.ids)
 
-                                    'public': False,
+                return _reply({'success': True, 'action': 'stopped', 'timesheet_id': line.id,
+                                            'skipped_files': skipped})
 
-                                })
-
-                                attachment_ids.append(att.id)
-
-                                self._create_document_from_attachment(att, task)
-
-                            except Exception as ex:
-
-                                _logger.error("Attachment upload error: %s", ex)
-
-                if attachment_ids:
-                    line.message_post(body=f"Timer stopped with {len(attachment_ids)} attachment(s).",
-
-                                      attachment_ids=attachment_ids)
-
-                return Response(json.dumps({'success': True, 'action': 'stopped', 'timesheet_id': line.id}),
-
-                                content_type='application/json')
-
-            return Response(json.dumps({'success': False, 'error': 'Invalid action'}), content_type='application/json')
+            return _reply({'success': False, 'error': 'Invalid action'})
+        except psycopg2.errors.TransactionRollbackError:
+            # serialization failure / deadlock: diulang oleh Odoo (service.model.retrying)
+            raise
         except Exception as e:
             _logger.error("Timer error: %s", e)
             return Response(json.dumps({'success': False, 'error': str(e)}), content_type='application/json')
@@ -1993,7 +2288,7 @@ class PortalProjectControllers(http.Controller):
             if not task:
                 return Response(json.dumps({'success': False, 'error': 'Task not found'}),
                                 content_type='application/json')
-            employee = request.env['hr.employee'].sudo().search([('user_id', '=', request.env.user.id)], limit=1)
+            employee = self._portal_ctx().employee
             if not employee:
                 return Response(json.dumps({'success': False, 'error': 'Employee not found'}),
                                 content_type='application/json')
@@ -2044,7 +2339,7 @@ class PortalProjectControllers(http.Controller):
             if not ts or ts.task_id.id != task_id:
                 return Response(json.dumps({'success': False, 'error': 'Timesheet not found'}),
                                 content_type='application/json')
-            employee = request.env['hr.employee'].sudo().search([('user_id', '=', request.env.user.id)], limit=1)
+            employee = self._portal_ctx().employee
             if not employee:
                 return Response(json.dumps({'success': False, 'error': 'Employee not found'}),
                                 content_type='application/json')
@@ -2094,6 +2389,187 @@ class PortalProjectControllers(http.Controller):
             _logger.error("Timesheet correction error: %s", e)
             return Response(json.dumps({'success': False, 'error': str(e)}), content_type='application/json')
 
+    # ---------------- TIMESHEET REQUEST APPROVAL ----------------
+    def _approvable_requests(self, reqs):
+        """Subset reqs yang boleh di-approve / reject user ini, lewat _approvable_request_domain
+        (satu aturan untuk route single, bulk & inbox)."""
+        if not reqs:
+            return reqs
+        return reqs.search(expression.AND([[('id', 'in', reqs.ids)], self._approvable_request_domain()]))
+
+    def _reject_requests(self, reqs, reason):
+        if hasattr(reqs, 'action_reject'):
+            reqs.with_context(rejection_reason=reason).action_reject()
+        else:
+            vals = {'z_state': 'rejected'}
+            if reason and hasattr(reqs, 'z_reason_reject'):
+                vals['z_reason_reject'] = reason
+            if reason and hasattr(reqs, 'z_reason_reject_description'):
+                vals['z_reason_reject_description'] = reason
+            reqs.write(vals)
+
+    @http.route('/portal/timesheet-requests/bulk', type='http', auth='user', website=True, methods=['POST'])
+    def portal_bulk_timesheet_requests(self, **kw):
+        """Approve / reject banyak request (new & correction) sekaligus.
+        request_ids: id dipisah koma (maks 500); action: approve | reject; reason: alasan reject.
+        Diproses per grup dalam satu panggilan ORM; bila grup gagal, diulang per record agar error per id jelas."""
+        try:
+            action = kw.get('action')
+            if action not in ('approve', 'reject'):
+                return Response(json.dumps({'success': False, 'error': 'Invalid action'}),
+                                content_type='application/json')
+            req_ids = []
+            for raw in (kw.get('request_ids') or '').split(','):
+                raw = raw.strip()
+                if raw.isdigit() and int(raw) not in req_ids:
+                    req_ids.append(int(raw))
+            if not req_ids or len(req_ids) > 500:
+                return Response(json.dumps({'success': False, 'error': 'Invalid request_ids'}),
+                                content_type='application/json')
+            reason = (kw.get('reason') or '').strip()
+
+            Req = request.env['account.analytic.line.request'].sudo()
+            reqs = Req.browse(req_ids).exists()
+            pending = reqs.filtered(lambda r: r.z_state == 'waiting_approval')
+            allowed = self._approvable_requests(pending)
+
+            results = {}
+            for req_id in req_ids:
+                if req_id not in reqs.ids:
+                    results[req_id] = {'id': req_id, 'success': False, 'error': 'Request not found'}
+                elif req_id not in pending.ids:
+                    results[req_id] = {'id': req_id, 'success': False, 'error': 'Request already processed'}
+                elif req_id not in allowed.ids:
+                    results[req_id] = {'id': req_id, 'success': False, 'error': 'Not allowed'}
+
+            def _apply(recs):
+                if action == 'approve':
+                    recs.action_approve()
+                else:
+                    self._reject_requests(recs, reason)
+
+            for request_type in ('new', 'correction'):
+                group = allowed.filtered(lambda r: r.z_request_type == request_type)
+                if not group:
+                    continue
+                try:
+                    with request.env.cr.savepoint():
+                        _apply(group)
+                    results.update({rid: {'id': rid, 'success': True} for rid in group.ids})
+                except Exception:
+                    for rec in group:
+                        try:
+                            with request.env.cr.savepoint():
+                                _apply(rec)
+                            results[rec.id] = {'id': rec.id, 'success': True}
+                        except Exception as e:
+                            results[rec.id] = {'id': rec.id, 'success': False, 'error': str(e)}
+
+            rows = [results[req_id] for req_id in req_ids]
+            return Response(json.dumps({
+                'success': True,
+                'processed': sum(1 for r in rows if r['success']),
+                'results': rows,
+            }), content_type='application/json')
+        except Exception as e:
+            _logger.error("Bulk timesheet request error: %s", e)
+            return Response(json.dumps({'success': False, 'error': str(e)}), content_type='application/json')
+
+    def _approvable_request_domain(self):
+        """Aturan approve / reject request timesheet sebagai domain (dievaluasi di database).
+        Task 'others' (z_task_id, atau task timesheet bila z_task_id kosong): PM / admin / manager langsung
+        employee pengaju; selain itu: can_approve_timesheet."""
+        flags = self._role_flags()
+        others = ['|', ('z_task_id.z_type_non_project', '=', 'others'),
+                  '&', ('z_task_id', '=', False), ('z_timesheet_id.task_id.z_type_non_project', '=', 'others')]
+        parts = []
+        if flags.get('can_approve_timesheet'):
+            parts.append(['!'] + others)
+        if flags.get('is_pm') or flags.get('is_admin'):
+            parts.append(others)
+        else:
+            subordinate_ids = self._portal_ctx().subordinate_ids
+            if subordinate_ids:
+                parts.append(expression.AND([others, [('z_employee_id', 'in', list(subordinate_ids))]]))
+        return expression.OR(parts) if parts else [('id', '=', 0)]
+
+    @http.route('/portal/approvals', type='http', auth='user', website=True)
+    def portal_approval_inbox(self, after=None, before=None, project_id=None, employee_id=None,
+                              request_type=None, **kw):
+        """Inbox approver: semua request waiting yang boleh di-approve viewer, lintas project.
+        Paging keyset pada id (after / before), filter project / employee / tipe, count via _read_group."""
+        step = 30
+        Req = request.env['account.analytic.line.request'].sudo()
+        project_id = int(project_id) if (project_id or '').isdigit() else False
+        employee_id = int(employee_id) if (employee_id or '').isdigit() else False
+        request_type = request_type if request_type in ('new', 'correction') else False
+
+        base = expression.AND([[('z_state', '=', 'waiting_approval')], self._approvable_request_domain()])
+        filters = {
+            'project': project_id and [
+                '|', ('z_task_id.project_id', '=', project_id),
+                ('z_timesheet_id.task_id.project_id', '=', project_id),
+            ],
+            'employee': employee_id and self._request_employee_domain(Req, [employee_id]),
+            'type': request_type and [('z_request_type', '=', request_type)],
+        }
+
+        def _domain(*skip):
+            return expression.AND([base] + [d for key, d in filters.items() if d and key not in skip])
+
+        domain = _domain()
+        if before and before.isdigit():
+            reqs = Req.search(expression.AND([domain, [('id', '<', int(before))]]), order='id desc', limit=step + 1)
+            has_prev = len(reqs) > step
+            reqs = reqs[:step].sorted('id')
+            has_next = True
+        else:
+            after_id = int(after) if (after or '').isdigit() else 0
+            reqs = Req.search(expression.AND([domain, [('id', '>', after_id)]]), order='id asc', limit=step + 1)
+            has_next = len(reqs) > step
+            reqs = reqs[:step]
+            has_prev = bool(after_id)
+
+        type_counts = dict(Req._read_group(_domain('type'), ['z_request_type'], ['__count']))
+        employee_counts = [
+            (emp, count) for emp, count in Req._read_group(_domain('employee'), ['z_employee_id'], ['__count'])
+            if emp
+        ]
+        # task request = z_task_id, atau task timesheet asal bila kosong (sama dengan domain filter project)
+        project_totals = defaultdict(int)
+        project_domain = _domain('project')
+        for task, count in Req._read_group(
+                expression.AND([project_domain, [('z_task_id', '!=', False)]]), ['z_task_id'], ['__count']):
+            project_totals[task.project_id] += count
+        for timesheet, count in Req._read_group(
+                expression.AND([project_domain, [('z_task_id', '=', False)]]), ['z_timesheet_id'], ['__count']):
+            project_totals[timesheet.task_id.project_id] += count
+        project_counts = sorted(
+            ((project, count) for project, count in project_totals.items() if project),
+            key=lambda pc: pc[0].display_name or '',
+        )
+
+        url_args = {k: v for k, v in (('project_id', project_id), ('employee_id', employee_id),
+                                      ('request_type', request_type)) if v}
+        values = {
+            'page_name': 'approval_inbox',
+            'requests': reqs,
+            'req_disp_map': self._request_display_map(reqs),
+            'total': sum(type_counts.values()) if not request_type else type_counts.get(request_type, 0),
+            'type_counts': type_counts,
+            'employee_counts': sorted(employee_counts, key=lambda ec: ec[0].name or ''),
+            'project_counts': project_counts,
+            'project_id': project_id,
+            'employee_id': employee_id,
+            'request_type': request_type,
+            'url_args': url_args,
+            'filter_url': lambda **changes: '/portal/approvals?' + urlencode(
+                {k: v for k, v in dict(url_args, **changes).items() if v}),
+            'next_url': has_next and reqs and '/portal/approvals?' + urlencode(dict(url_args, after=reqs[-1].id)),
+            'prev_url': has_prev and reqs and '/portal/approvals?' + urlencode(dict(url_args, before=reqs[0].id)),
+        }
+        return request.render('z_project.portal_approval_inbox', values)
+
     @http.route('/portal/timesheet-correction/<int:req_id>/approve', type='http', auth='user', website=True,
                 methods=['POST'])
     def portal_approve_timesheet_correction(self, req_id, **kw):
@@ -2103,22 +2579,7 @@ class PortalProjectControllers(http.Controller):
                 return Response(json.dumps({'success': False, 'error': 'Request not found'}),
                                 content_type='application/json')
 
-            flags = self._role_flags()
-            is_pm = flags.get('is_pm')
-            is_admin = flags.get('is_admin')
-
-            task = Req.z_task_id or (Req.z_timesheet_id and Req.z_timesheet_id.task_id)
-            req_emp = Req.z_employee_id
-            cur_emp = request.env['hr.employee'].sudo().search([('user_id', '=', request.env.user.id)], limit=1)
-
-            allowed = False
-            if task and task.z_type_non_project == 'others':
-                is_manager = bool(cur_emp and req_emp and req_emp.parent_id and req_emp.parent_id.id == cur_emp.id)
-                allowed = bool(is_pm or is_admin or is_manager)
-            else:
-                allowed = bool(flags.get('can_approve_timesheet'))
-
-            if not allowed:
+            if not self._approvable_requests(Req):
                 return Response(json.dumps({'success': False, 'error': 'Not allowed'}), content_type='application/json')
 
             Req.action_approve()
@@ -2136,34 +2597,10 @@ class PortalProjectControllers(http.Controller):
                 return Response(json.dumps({'success': False, 'error': 'Request not found'}),
                                 content_type='application/json')
 
-            flags = self._role_flags()
-            is_pm = flags.get('is_pm')
-            is_admin = flags.get('is_admin')
-
-            task = Req.z_task_id or (Req.z_timesheet_id and Req.z_timesheet_id.task_id)
-            req_emp = Req.z_employee_id
-            cur_emp = request.env['hr.employee'].sudo().search([('user_id', '=', request.env.user.id)], limit=1)
-
-            allowed = False
-            if task and task.z_type_non_project == 'others':
-                is_manager = bool(cur_emp and req_emp and req_emp.parent_id and req_emp.parent_id.id == cur_emp.id)
-                allowed = bool(is_pm or is_admin or is_manager)
-            else:
-                allowed = bool(flags.get('can_approve_timesheet'))
-
-            if not allowed:
+            if not self._approvable_requests(Req):
                 return Response(json.dumps({'success': False, 'error': 'Not allowed'}), content_type='application/json')
 
-            reason = kw.get('reason', '').strip()
-            if hasattr(Req, 'action_reject'):
-                Req.with_context(rejection_reason=reason).action_reject()
-            else:
-                vals = {'z_state': 'rejected'}
-                if reason and hasattr(Req, 'z_reason_reject'):
-                    vals['z_reason_reject'] = reason
-                if reason and hasattr(Req, 'z_reason_reject_description'):
-                    vals['z_reason_reject_description'] = reason
-                Req.write(vals)
+            self._reject_requests(Req, kw.get('reason', '').strip())
             return Response(json.dumps({'success': True}), content_type='application/json')
         except Exception as e:
             _logger.error("Reject correction error: %s", e)
@@ -2179,22 +2616,7 @@ class PortalProjectControllers(http.Controller):
                 return Response(json.dumps({'success': False, 'error': 'Request not found'}),
                                 content_type='application/json')
 
-            flags = self._role_flags()
-            is_pm = flags.get('is_pm')
-            is_admin = flags.get('is_admin')
-
-            task = Req.z_task_id
-            req_emp = Req.z_employee_id
-            cur_emp = request.env['hr.employee'].sudo().search([('user_id', '=', request.env.user.id)], limit=1)
-
-            allowed = False
-            if task and task.z_type_non_project == 'others':
-                is_manager = bool(cur_emp and req_emp and req_emp.parent_id and req_emp.parent_id.id == cur_emp.id)
-                allowed = bool(is_pm or is_admin or is_manager)
-            else:
-                allowed = bool(flags.get('can_approve_timesheet'))
-
-            if not allowed:
+            if not self._approvable_requests(Req):
                 return Response(json.dumps({'success': False, 'error': 'Not allowed'}), content_type='application/json')
 
             Req.action_approve()
@@ -2212,34 +2634,10 @@ class PortalProjectControllers(http.Controller):
                 return Response(json.dumps({'success': False, 'error': 'Request not found'}),
                                 content_type='application/json')
 
-            flags = self._role_flags()
-            is_pm = flags.get('is_pm')
-            is_admin = flags.get('is_admin')
-
-            task = Req.z_task_id
-            req_emp = Req.z_employee_id
-            cur_emp = request.env['hr.employee'].sudo().search([('user_id', '=', request.env.user.id)], limit=1)
-
-            allowed = False
-            if task and task.z_type_non_project == 'others':
-                is_manager = bool(cur_emp and req_emp and req_emp.parent_id and req_emp.parent_id.id == cur_emp.id)
-                allowed = bool(is_pm or is_admin or is_manager)
-            else:
-                allowed = bool(flags.get('can_approve_timesheet'))
-
-            if not allowed:
+            if not self._approvable_requests(Req):
                 return Response(json.dumps({'success': False, 'error': 'Not allowed'}), content_type='application/json')
 
-            reason = kw.get('reason', '').strip()
-            if hasattr(Req, 'action_reject'):
-                Req.with_context(rejection_reason=reason).action_reject()
-            else:
-                vals = {'z_state': 'rejected'}
-                if reason and hasattr(Req, 'z_reason_reject'):
-                    vals['z_reason_reject'] = reason
-                if reason and hasattr(Req, 'z_reason_reject_description'):
-                    vals['z_reason_reject_description'] = reason
-                Req.write(vals)
+            self._reject_requests(Req, kw.get('reason', '').strip())
             return Response(json.dumps({'success': True}), content_type='application/json')
         except Exception as e:
             _logger.error("Reject request error: %s", e)
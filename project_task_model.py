@@ -0,0 +1,168 @@
+from odoo import models, fields, api, tools
+from odoo.tools import SQL
+from odoo.tools.sql import create_index
+
+# compute yang dijalankan ulang oleh _recompute_portal_derived; input-nya diambil dari @api.depends
+PORTAL_DERIVED_COMPUTES = (
+    '_compute_actual_dates', '_compute_progress', '_getMandaysBudget', '_getMandaysBudgetEntry',
+    '_getActualMandaysBudget', '_getSubtaskCount', '_getTimesheetCount', '_getProjectTeams',
+    '_getQualityCalculation',
+)
+
+# input yang tidak tercakup depends (onchange_bobot_entry / action_bobot_sync bukan compute)
+PORTAL_DIRTY_FIELDS = {
+    'parent_id', 'project_id', 'z_bobot_entry', 'z_bobot',
+    'z_planned_start_date', 'z_planned_end_date',
+    'z_head_assignes_ids', 'z_member_assignes_ids',
+    'z_quality_entry', 'z_progress_project_entry', 'z_project_task_state', 'z_mandays_budget_entry',
+}
+
+
+class ProjectTask(models.Model):
+
+    _inherit = ["project.task"]
+    # parent_path ("1/5/9/") dipelihara ORM saat create / re-parent, dipakai portal untuk depth & root task
+    _parent_store = True
+    # perubahan massal di atas batas ini tidak dihitung saat commit, diserahkan ke cron (batch)
+    _portal_dirty_sync_limit = 200
+
+    @api.depends('name', 'project_id.name', 'partner_id.name', 'z_master_task_id.z_complete_name')
+    def _getSearchDocument(self):
+        for this in self:
+            parts = [
+                this.name,
+                this.project_id.name,
+                this.partner_id.name,
+                this.z_master_task_id.z_complete_name,
+            ]
+            # dipisah newline agar kata kunci tidak match lintas kolom
+            this.z_search_document = '\n'.join(p for p in parts if p)
+
+    parent_path = fields.Char(index=True)
+    # dokumen pencarian portal (kode task, project, customer, master task) dengan index trigram
+    z_search_document = fields.Char(string='Search Document', compute=_getSearchDocument, store=True, index='trigram')
+    # True = nilai turunan task perlu dihitung ulang (diproses saat commit / cron)
+    z_portal_dirty = fields.Boolean(string='Portal Recompute Pending', copy=False)
+
+    def init(self):
+        super().init()
+        create_index(
+            self.env.cr,
+            'project_task_z_portal_dirty_idx',
+            self._table,
+            ['id'],
+            where='z_portal_dirty IS TRUE',
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._mark_portal_dirty()
+        return records
+
+    def write(self, vals):
+        old_parents = self.parent_id if 'parent_id' in vals else self.browse()
+        res = super().write(vals)
+        if self._portal_dirty_fields(self._name).intersection(vals):
+            (self | old_parents)._mark_portal_dirty()
+        return res
+
+    def unlink(self):
+        parents = self.parent_id - self
+        res = super().unlink()
+        parents.exists()._mark_portal_dirty()
+        return res
+
+    @api.model
+    @tools.ormcache('model_name')
+    def _portal_dirty_fields(self, model_name):
+        """Field di model_name (project.task / account.analytic.line) yang dibaca compute turunan portal.
+        Diturunkan dari depends PORTAL_DERIVED_COMPUTES, termasuk field inverse dari one2many yang dilalui."""
+        fnames = set()
+        for field in self._fields.values():
+            if field.compute not in PORTAL_DERIVED_COMPUTES:
+                continue
+            for path in self.pool.field_depends[field]:
+                model = self
+                for fname in path.split('.'):
+                    sub = model._fields.get(fname)
+                    if sub is None:
+                        break
+                    if model._name == model_name:
+                        fnames.add(fname)
+                    if not sub.relational:
+                        break
+                    if sub.type == 'one2many' and sub.comodel_name == model_name:
+                        fnames.add(sub.inverse_name)
+                    model = self.env[sub.comodel_name]
+        if model_name == self._name:
+            fnames |= PORTAL_DIRTY_FIELDS
+        return frozenset(fnames)
+
+    def _mark_portal_dirty(self, defer=False):
+        """Tandai task beserta seluruh parent-nya untuk dihitung ulang.
+        Perhitungan dijalankan sekali per transaksi saat commit (precommit), sisanya oleh cron.
+        defer=True: hanya ditandai, perhitungan sepenuhnya oleh cron."""
+        if not self or self.env.context.get('z_portal_recompute'):
+            return
+        task_ids = set()
+        for row in self.sudo().read(['parent_path'], load=False):
+            if row['parent_path']:
+                task_ids.update(int(x) for x in row['parent_path'].split('/') if x)
+            else:
+                task_ids.add(row['id'])
+        self.env.cr.execute(SQL(
+            "UPDATE project_task SET z_portal_dirty = TRUE WHERE id = ANY(%s) AND z_portal_dirty IS NOT TRUE",
+            list(task_ids),
+        ))
+        self.env['project.task'].invalidate_model(['z_portal_dirty'])
+        if defer:
+            return
+
+        pending = self.env.cr.precommit.data.setdefault('z_portal_dirty_task_ids', set())
+        if not pending:
+            self.env.cr.precommit.add(self.env['project.task'].sudo()._flush_portal_dirty)
+        pending.update(task_ids)
+
+    def _flush_portal_dirty(self):
+        task_ids = self.env.cr.precommit.data.pop('z_portal_dirty_task_ids', set())
+        self.browse(task_ids).exists()._recompute_portal_derived()
+        # compute / sync di atas juga menulis model lain & task di luar set: flush semua sebelum COMMIT
+        self.env.flush_all()
+
+    def _recompute_portal_derived(self):
+        """Hitung ulang nilai turunan task (tanggal aktual, progress, mandays, count, bobot, team, quality).
+        Subtask diproses lebih dulu agar rollup parent memakai nilai terbaru."""
+        if not self:
+            return
+        tasks = self.sudo().with_context(z_portal_recompute=True)
+        for t in tasks.sorted(lambda r: -len(r.parent_path or '')):
+            t._compute_actual_dates()
+            t._compute_progress()
+            t._getMandaysBudget()
+            t._getMandaysBudgetEntry()
+            t._getActualMandaysBudget()
+            t._getSubtaskCount()
+            t._getTimesheetCount()
+            t.onchange_bobot_entry()
+            t._getProjectTeams()
+            t._getQualityCalculation()
+            t.action_bobot_sync()
+        tasks.flush_recordset()
+        self.env.cr.execute(SQL(
+            "UPDATE project_task SET z_portal_dirty = FALSE WHERE id = ANY(%s)",
+            tasks.ids,
+        ))
+        self.env['project.task'].invalidate_model(['z_portal_dirty'])
+
+    @api.model
+    def _cron_recompute_portal_dirty(self, batch_size=200):
+        """Proses task dirty yang belum terhitung (mis. data hasil import / update SQL)."""
+        tasks = self.sudo().search([('z_portal_dirty', '=', True)], limit=batch_size)
+        tasks._recompute_portal_derived()
+        return True
+
+    def action_sync_parent_path(self):
+        """Backfill parent_path untuk semua task (database lama / data hasil import SQL)."""
+        self.env['project.task'].sudo()._parent_store_compute()
+        return True
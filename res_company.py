@@ -0,0 +1,9 @@
+from odoo import models, fields
+
+
+class ResCompany(models.Model):
+
+    _inherit = ["res.company"]
+
+    # timer portal yang masih berjalan / pause lebih lama dari ini ditutup otomatis oleh cron (0 = nonaktif)
+    z_timer_autostop_hours = fields.Integer(string='Auto-stop Running Timers After (Hours)', default=12)
@@ -0,0 +1,155 @@
+from odoo import models, tools
+
+
+class ResUsers(models.Model):
+
+    _inherit = ["res.users"]
+
+    @tools.ormcache('self.id')
+    def _get_portal_role_flags(self):
+        """Role & permission portal project untuk user ini.
+        Cache per user; invalidasi saat groups / z_project_group_id berubah (registry.clear_cache)."""
+        self.ensure_one()
+        user = self.sudo()
+        is_internal_super = user.has_group('base.group_user') and not user.has_group('base.group_portal')
+        group_rec = getattr(user, 'z_project_group_id', False)
+        group_name = group_rec.name if group_rec else ''
+
+        name_map = {
+            'Projects: Administrator': 'project_admin',
+            'Projects: Project Manager': 'project_manager',
+            'Projects: Head': 'project_head',
+            'Projects: Staff': 'project_engineer',
+            'Projects: Staff Engineer': 'project_engineer',
+            'Projects: Staff Support': 'project_delivery_support',
+            'Projects: Readonly': 'project_readonly',
+            'Projects: Head Engineer': 'project_head',
+            'Projects: Delivery Support': 'project_delivery_support',
+        }
+        ga = name_map.get(group_name)
+
+        if not ga and group_rec:
+            try:
+                xmlid_full = group_rec.get_external_id().get(group_rec.id)
+            except Exception:
+                xmlid_full = None
+            if xmlid_full:
+                suffix_map = {
+                    '_project_manager': 'project_manager',
+                    '_lead': 'project_head',
+                    '_head_engineer': 'project_head',
+                    '_user': 'project_engineer',
+                    '_readonly': 'project_delivery_support',
+                }
+                for suf, code in suffix_map.items():
+                    if xmlid_full.endswith(suf):
+                        ga = code
+                        break
+
+        if is_internal_super and not ga:
+            ga = 'project_admin'
+
+        is_admin = (ga == 'project_admin')
+        is_pm = (ga == 'project_manager')
+        is_head = (ga == 'project_head')
+        is_engineer = (ga == 'project_engineer')
+        is_delivery = (ga == 'project_delivery_support')
+        is_readonly = (ga == 'project_readonly')
+
+        is_head_engineer = is_head
+
+        # Permissions
+        can_approve_timesheet = (is_admin or is_pm or is_head)
+        can_submit_task = (is_admin or is_pm or is_head or is_engineer)
+        can_approve_task = (is_admin or is_pm)
+        can_reject_task = (is_admin or is_pm or is_head)
+        can_finish_task = (is_admin or is_pm)
+        can_update_task = (is_admin or is_pm or is_head) and not is_readonly
+        can_view_project_page = (is_admin or is_pm)
+
+        flags = {
+            'groups_access': ga,
+            'is_internal_super': is_internal_super,
+
+            'is_admin': is_admin,
+            'is_pm': (is_pm or is_admin),
+
+            'is_head': is_head,
+            'is_head_engineer': is_head_engineer,
+
+            'is_engineer': is_engineer,
+            'is_delivery_support': is_delivery,
+
+            'is_readonly_user': is_readonly,
+
+            'is_support': is_delivery or is_readonly,
+            'is_staff': is_engineer or is_delivery,
+
+            'can_create_task': (is_admin or is_pm),
+            'can_update_task': can_update_task,
+            'can_delete_task': (is_admin or is_pm) and not is_readonly,
+            'can_submit_task': can_submit_task and not is_readonly,
+            'can_approve_task': can_approve_task and not is_readonly,
+            'can_reject_task': can_reject_task and not is_readonly,
+            'can_finish_task': can_finish_task and not is_readonly,
+            'can_create_subtask': (is_admin or is_pm or is_head) and not is_readonly,
+            'can_delete_subtask': (is_admin or is_pm) and not is_readonly,
+
+            'can_approve_timesheet': can_approve_timesheet,
+            'can_delete_timesheet': can_approve_timesheet and not is_readonly,
+
+            # Engineer/Delivery/Readonly dibatasi melihat timesheet sendiri,
+            'restrict_timesheet_to_self': (is_engineer or is_delivery or is_readonly) and not (
+                        is_admin or is_pm or is_head),
+            'show_tab_invoice_plan': (is_admin or is_pm or is_head or is_delivery or is_readonly or is_internal_super),
+            'can_edit_invoice_plan': (is_admin or is_pm) and not is_readonly,
+
+            'show_tab_description': (is_admin or is_pm or is_head) and not is_readonly,
+            'show_tab_subtasks': (is_admin or is_pm or is_head) and not is_readonly,
+            'show_metrics': (is_admin or is_pm or is_head) and not is_readonly,
+            'show_quality': (is_admin or is_pm or is_head) and not is_readonly,
+
+            'can_view_project_page': can_view_project_page,
+        }
+        return flags
+
+    def _get_portal_context_data(self):
+        """Employee, status portal & bawahan langsung user ini (hanya id, aman di-cache).
+        Invalidasi saat employee user_id / parent_id berubah (versi cache hr.employee, lihat hr.employee.write)."""
+        self.ensure_one()
+        versions = self.env['z.portal.cache.version']._get_versions(['hr.employee'])
+        return self._get_portal_context_data_cached(versions)
+
+    @tools.ormcache('self.id', 'versions')
+    def _get_portal_context_data_cached(self, versions):
+        self.ensure_one()
+        user = self.sudo()
+        employee = self.env['hr.employee'].sudo().search([('user_id', '=', user.id)], limit=1)
+        subordinate_ids = ()
+        if employee:
+            subordinate_ids = tuple(self.env['hr.employee'].sudo().with_context(active_test=False)._search(
+                [('parent_id', '=', employee.id)]))
+        return {
+            'is_portal': user.has_group('base.group_portal'),
+            'employee_id': employee.id,
+            'manager_id': employee.parent_id.id,
+            'subordinate_ids': subordinate_ids,
+        }
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'z_project_group_id' in vals or 'group_ids' in vals or 'groups_id' in vals:
+            self.env.registry.clear_cache()
+        return res
+
+
+class ResGroups(models.Model):
+
+    _inherit = ["res.groups"]
+
+    def write(self, vals):
+        res = super().write(vals)
+        # mapping role portal memakai nama group
+        if 'name' in vals:
+            self.env.registry.clear_cache()
+        return res
@@ -0,0 +1,30 @@
+/** @odoo-module **/
+
+import publicWidget from "@web/legacy/js/public/public_widget";
+
+/**
+ * Teruskan notifikasi bus "z_portal_timer" (channel partner user) ke halaman task portal
+ * sebagai event DOM; state diterapkan oleh script halaman (applyTimerState).
+ */
+publicWidget.registry.ZPortalTimerBus = publicWidget.Widget.extend({
+    selector: "#runningTimerBadge",
+
+    init() {
+        this._super(...arguments);
+        this.busService = this.bindService("bus_service");
+        this._onTimerNotification = (payload) => {
+            document.dispatchEvent(new CustomEvent("z_portal_timer", { detail: payload }));
+        };
+    },
+
+    start() {
+        this.busService.subscribe("z_portal_timer", this._onTimerNotification);
+        this.busService.start();
+        return this._super(...arguments);
+    },
+
+    destroy() {
+        this.busService.unsubscribe("z_portal_timer", this._onTimerNotification);
+        this._super(...arguments);
+    },
+});